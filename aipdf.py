@@ -1,4 +1,5 @@
 import os
+import hashlib
 import fitz  # PyMuPDF
 from langchain_community.llms import Ollama
 from langchain_core.prompts import ChatPromptTemplate
@@ -8,9 +9,20 @@ import pytesseract
 from PIL import Image
 import io
 from tqdm import tqdm
+from context_packing import count_tokens
 
 class RobustPDFProcessor:
-    def __init__(self, model_name="mistral", batch_size=1):
+    """Converts PDFs to structured text through an Ollama chain.
+
+    With ``window_tokens`` set, pages are grouped into windows of at most that
+    many tokens, the windows are converted concurrently and merged in page
+    order. Each window's output is cached under ``cache_dir`` by a hash of its
+    content, so re-running after a failure only converts the failed windows.
+    Without it the whole document goes through one call, as before.
+    """
+
+    def __init__(self, model_name="mistral", batch_size=1, window_tokens=None, window_workers=4, cache_dir=None):
+        self.model_name = model_name
         self.llm = Ollama(
             model=model_name,
             temperature=0.2,
@@ -19,6 +31,9 @@ class RobustPDFProcessor:
         )
         self.chain = self._create_chain()
         self.batch_size = batch_size
+        self.window_tokens = window_tokens
+        self.window_workers = window_workers
+        self.cache_dir = cache_dir
 
     def _create_chain(self):
         prompt = ChatPromptTemplate.from_template("""
@@ -52,32 +67,92 @@ class RobustPDFProcessor:
             print(f"Extraction error: {str(e)}")
             return ""
 
-    def process_pdf(self, pdf_path):
-        try:
-            doc = fitz.open(pdf_path)
-            elements = []
+    def _page_elements(self, pdf_path):
+        doc = fitz.open(pdf_path)
+        elements = []
+        
+        for page_num, page in enumerate(doc):
+            content = []
             
-            for page_num, page in enumerate(doc):
-                content = []
-                
-                text = self._extract_text(page)
-                if text.strip():
-                    content.append(f"[PAGE {page_num + 1} TEXT]\n{text}")
-                
-                try:
-                    tables = page.find_tables()
-                    if tables.tables:
-                        for table in tables.tables:
-                            table_str = "\n".join("|".join(str(cell or "") for cell in row) for row in table.extract())
-                            content.append(f"[PAGE {page_num + 1} TABLE]\n{table_str}")
-                except Exception:
-                    pass
-                
-                if content:
-                    elements.append("\n".join(content))
+            text = self._extract_text(page)
+            if text.strip():
+                content.append(f"[PAGE {page_num + 1} TEXT]\n{text}")
+            
+            try:
+                tables = page.find_tables()
+                if tables.tables:
+                    for table in tables.tables:
+                        table_str = "\n".join("|".join(str(cell or "") for cell in row) for row in table.extract())
+                        content.append(f"[PAGE {page_num + 1} TABLE]\n{table_str}")
+            except Exception:
+                pass
             
-            doc.close()
-            return self.chain.invoke({"content": "\n\n".join(elements)}) if elements else None
+            if content:
+                elements.append("\n".join(content))
+        
+        doc.close()
+        return elements
+
+    def _windows(self, elements):
+        """Group consecutive pages into windows of at most ``window_tokens`` tokens.
+
+        A page larger than the budget becomes a window on its own.
+        """
+        windows, current, used = [], [], 0
+        for element in elements:
+            tokens = count_tokens(element)
+            if current and used + tokens > self.window_tokens:
+                windows.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(element)
+            used += tokens
+        if current:
+            windows.append("\n\n".join(current))
+        return windows
+
+    def _cache_path(self, content):
+        key = hashlib.sha256(f"{self.model_name}\0{content}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def _convert_window(self, content):
+        cache_path = self._cache_path(content) if self.cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, encoding='utf-8') as f:
+                return f.read()
+        result = self.chain.invoke({"content": content})
+        if cache_path:
+            with open(cache_path + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(result)
+            os.replace(cache_path + ".tmp", cache_path)
+        return result
+
+    def _process_windows(self, pdf_path, elements):
+        windows = self._windows(elements)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.window_workers) as executor:
+            tasks = [executor.submit(self._convert_window, window) for window in windows]
+            results, failed = [], 0
+            for number, task in enumerate(tasks, 1):
+                try:
+                    results.append(task.result())
+                except Exception as e:
+                    failed += 1
+                    print(f"Error converting window {number}/{len(windows)} of {pdf_path}: {str(e)}")
+        if failed:
+            # finished windows are cached; a re-run only converts the failed ones
+            print(f"{pdf_path}: {failed} of {len(windows)} windows failed, re-run to retry them")
+            return None
+        return "\n\n".join(results)
+
+    def process_pdf(self, pdf_path):
+        try:
+            elements = self._page_elements(pdf_path)
+            if not elements:
+                return None
+            if self.window_tokens:
+                return self._process_windows(pdf_path, elements)
+            return self.chain.invoke({"content": "\n\n".join(elements)})
         
         except Exception as e:
             print(f"Error processing {pdf_path}: {str(e)}")
@@ -110,10 +185,18 @@ if __name__ == "__main__":
     parser.add_argument('output_dir', help='Output directory for text files')
     parser.add_argument('--model', default='mistral', help='Ollama model name')
     parser.add_argument('--batch', type=int, default=3, help='Parallel batch size')
+    parser.add_argument('--window-tokens', type=int, default=0,
+                        help='Convert page windows of this many tokens separately (0 = whole document in one call)')
+    parser.add_argument('--window-workers', type=int, default=4, help='Windows converted concurrently per PDF')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Window output cache (default: .window_cache in the output directory)')
     args = parser.parse_args()
 
     processor = RobustPDFProcessor(
         model_name=args.model,
-        batch_size=args.batch
+        batch_size=args.batch,
+        window_tokens=args.window_tokens,
+        window_workers=args.window_workers,
+        cache_dir=args.cache_dir or os.path.join(args.output_dir, ".window_cache")
     )
     processor.process_directory(args.input_dir, args.output_dir)
\ No newline at end of file
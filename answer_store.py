@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional, Tuple
+
+
+class AnswerStore:
+    """Bounded in-process LRU (near-cache) in front of a shared answer backend.
+
+    Misses fall through to the backend; new answers are buffered and written
+    in batches by a background thread instead of one write per answer. The
+    same thread polls the backend's generation so a clear issued by another
+    worker also empties this worker's near-cache. Buffered answers carry the
+    generation they were computed under and are dropped, not written, once
+    the backend has moved past it.
+    """
+
+    def __init__(self, backend, max_size: int = 10000, flush_interval: float = 1.0,
+                 batch_size: int = 200, sync_interval: float = 1.0,
+                 on_sync: Optional[Callable[[bool], None]] = None):
+        self.backend = backend
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.on_sync = on_sync
+        self.entries = OrderedDict()
+        self.pending = {}  # question -> (answer, generation it was computed under)
+        self.lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        # read before any put, so a clear issued before the first flush is noticed
+        self._generation = self._read_generation()
+        self._missed_clear = False  # a clear noticed by flush() that sync() has not reported yet
+        self._last_sync = 0.0
+        self._thread = threading.Thread(target=self._writer, name="answer-store-writer", daemon=True)
+        self._thread.start()
+
+    def _read_generation(self) -> Optional[int]:
+        try:
+            return self.backend.generation()
+        except Exception as e:
+            # unknown: whatever is buffered until it can be read is dropped
+            print(f"Error reading answer cache generation: {e}")
+            return None
+
+    def _remember(self, question: str, answer: str):
+        self.entries[question] = answer
+        self.entries.move_to_end(question)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def peek(self, question: str) -> Optional[str]:
+        """Memory-only lookup, safe to call from the event loop."""
+        with self.lock:
+            if question in self.entries:
+                self.entries.move_to_end(question)
+                return self.entries[question]
+            pending = self.pending.get(question)
+            return pending[0] if pending else None
+
+    def get(self, question: str) -> Optional[str]:
+        answer = self.peek(question)
+        if answer is not None:
+            return answer
+        answer = self.backend.get(question)
+        if answer is not None:
+            with self.lock:
+                self._remember(question, answer)
+        return answer
+
+    def put(self, question: str, answer: str):
+        with self.lock:
+            self._remember(question, answer)
+            self.pending[question] = (answer, self._generation)
+            if len(self.pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def _writer(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_sync >= self.sync_interval:
+                    self.sync()
+            except Exception as e:
+                print(f"Error flushing answer cache: {e}")
+
+    def _check_generation(self) -> bool:
+        """Drop the near-cache if another worker cleared the shared cache, and stale unwritten answers.
+
+        Callers hold ``_flush_lock``.
+        """
+        generation = self.backend.generation()
+        changed = generation != self._generation
+        self._generation = generation
+        with self.lock:
+            if changed:
+                self.entries.clear()
+            stale = [question for question, (_, seen) in self.pending.items() if seen != generation]
+            for question in stale:
+                del self.pending[question]
+        return changed
+
+    def flush(self):
+        with self._flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+            # answers computed before another worker's clear must not be written back
+            if self._check_generation():
+                self._missed_clear = True
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return
+            try:
+                self.backend.set_many({question: answer for question, (answer, _) in batch.items()})
+            except Exception:
+                with self.lock:
+                    # keep newer answers that arrived while this batch failed
+                    self.pending = {**batch, **self.pending}
+                raise
+
+    def sync(self) -> bool:
+        """Drop the near-cache if another worker cleared the shared cache."""
+        self._last_sync = time.monotonic()
+        with self._flush_lock:
+            changed = self._check_generation() or self._missed_clear
+            self._missed_clear = False
+        if self.on_sync is not None:
+            self.on_sync(changed)
+        return changed
+
+    def clear(self):
+        with self._flush_lock:
+            with self.lock:
+                self.entries.clear()
+                self.pending.clear()
+            self.backend.clear()
+            self._generation = self.backend.generation()
+
+    def iter_page(self, cursor: Optional[str] = None, limit: int = 100) -> Iterator[Tuple[str, str]]:
+        """Yield up to ``limit`` persisted entries ordered by question, after ``cursor``."""
+        return self.backend.iter_page(cursor, limit)
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
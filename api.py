@@ -1,27 +1,80 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from langchain_ollama import OllamaEmbeddings, OllamaLLM
 from langchain_chroma import Chroma
-from typing import List
+from typing import List, Optional
+import asyncio
+import hashlib
+import hmac
 import json
-import re
 import os
 import time
-from sqlalchemy import create_engine, Column, String, Text
+import uuid
+from sqlalchemy import create_engine, event, Column, Index, Integer, String, Text, Float
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, declarative_base
 from langchain_openai import ChatOpenAI
+from starlette.concurrency import run_in_threadpool
+from semantic_cache import SemanticCache
+from answer_store import AnswerStore
+from cache_backend import RedisAnswerBackend, SQLiteAnswerBackend
+from keywords import KeywordExtractor, KeywordMemo, fallback_keywords
+from retrieval import BM25Index, build_filters, hybrid_search
+from context_packing import count_tokens, get_tokenizer, pack_context
+from prompt_logger import PromptLogger
+from metrics import Registry
+from chat_store import ChatHistoryStore
+from embedding_cache import CachedEmbeddings
+from llm_router import LLMBackend, LLMRouter
+from vector_index import open_mmap_index
+from dedup import load_copies
 
 DB_DIR = r"C:\Users\MehlikaYikilmaz\rag_db1"
 OLLAMA_EMBEDDING_MODEL = "all-minilm"
 OLLAMA_LLM_MODEL = "phi3"
-LOG_DIR = "logs"
+OPENROUTER_MODEL = "deepseek/deepseek-r1-0528-qwen3-8b:free"
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+CACHE_DB_URL = os.getenv("CACHE_DB_URL", "sqlite:///cache.db")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_SIZE = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "5000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "0"))  # seconds, 0 = never expire
+QA_CACHE_MAX_SIZE = int(os.getenv("QA_CACHE_MAX_SIZE", "10000"))
+QA_CACHE_FLUSH_INTERVAL = float(os.getenv("QA_CACHE_FLUSH_INTERVAL", "1.0"))
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")  # "sqlite" or "redis", shared by all workers
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "1.0"))  # seconds between cross-worker syncs
+CACHE_PAGE_MAX_LIMIT = 1000
+CHAT_HISTORY_RETENTION = int(os.getenv("CHAT_HISTORY_RETENTION", "1000"))  # messages per user, 0 = keep all
+CHAT_PAGE_MAX_LIMIT = 200
+KEYWORD_MODE = os.getenv("KEYWORD_MODE", "llm")  # "llm" or "local" (IDF vocabulary from process.py)
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "8"))
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "mmap" (built by process.py)
+MMAP_NPROBE = int(os.getenv("MMAP_NPROBE", "8"))  # IVF lists scanned per query
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+LLM_BACKENDS = [b.strip() for b in os.getenv("LLM_BACKENDS", "remote,local").split(",") if b.strip()]
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds per call
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_SLOTS = int(os.getenv("LLM_HEDGE_SLOTS", "1"))  # concurrent hedges on top of LLM_CONCURRENCY
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+STARTUP_RETRY_MAX_DELAY = float(os.getenv("STARTUP_RETRY_MAX_DELAY", "60"))  # seconds between startup attempts
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))  # 0 disables micro-batching
+PROMPT_LOG_MAX_BYTES = int(os.getenv("PROMPT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+PROMPT_LOG_BACKUPS = int(os.getenv("PROMPT_LOG_BACKUPS", "5"))
+PROMPT_LOG_QUEUE_SIZE = int(os.getenv("PROMPT_LOG_QUEUE_SIZE", "1000"))
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv("PROMPT_LOG_SAMPLE_RATE", "0.1"))
 os.makedirs(LOG_DIR, exist_ok=True)  
 os.environ["OPENAI_API_KEY"] = "Your-OpenAI-API-Key"  # Replace with your actual OpenAI API key
 os.environ["OPENAI_API_BASE"] = "https://openrouter.ai/api/v1"
 
 
-PROMPT_LOG_PATH = os.path.join(LOG_DIR, "prompts.log")
+# one file per worker process; see PromptLogger
+PROMPT_LOG_PATH = os.path.join(LOG_DIR, "prompts.{pid}.jsonl")
 
 app = FastAPI()
 app.add_middleware(
@@ -32,7 +85,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-engine = create_engine("sqlite:///cache.db", connect_args={"check_same_thread": False})
+metrics_registry = Registry()
+stage_latency = metrics_registry.histogram(
+    "rag_stage_duration_seconds", "Latency of each /ask pipeline stage.", labels=["stage"])
+request_latency = metrics_registry.histogram(
+    "rag_request_duration_seconds", "End-to-end request latency.", labels=["endpoint"])
+requests_in_flight = metrics_registry.gauge(
+    "rag_requests_in_flight", "Requests currently being served.", labels=["endpoint"])
+cache_requests = metrics_registry.counter(
+    "rag_cache_requests_total", "Answer cache lookups by result.", labels=["result"])
+llm_errors = metrics_registry.counter(
+    "rag_llm_errors_total", "Failed LLM calls.", labels=["call"])
+llm_tokens = metrics_registry.counter(
+    "rag_llm_tokens_total", "Tokens sent to and received from the LLM.", labels=["kind"])
+llm_routes = metrics_registry.counter(
+    "rag_llm_route_total", "LLM routing decisions by backend and outcome.", labels=["backend", "outcome"])
+llm_backend_latency = metrics_registry.histogram(
+    "rag_llm_backend_duration_seconds", "Successful LLM call latency per backend.", labels=["backend"])
+
+engine = create_engine(CACHE_DB_URL, connect_args={"check_same_thread": False})
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 Session = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -41,28 +120,105 @@ class QACache(Base):
     question = Column(String, primary_key=True)
     answer = Column(Text)
 
+class QASemanticCache(Base):
+    __tablename__ = "qa_semantic_cache"
+    question = Column(String, primary_key=True)
+    embedding = Column(Text)
+    answer = Column(Text)
+    created_at = Column(Float)
+
+class CacheMeta(Base):
+    __tablename__ = "cache_meta"
+    key = Column(String, primary_key=True)
+    value = Column(Integer)
+
+class UserAccount(Base):
+    __tablename__ = "users"
+    email = Column(String, primary_key=True)
+    password = Column(String)
+
+class ChatHistory(Base):
+    __tablename__ = "chat_history"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    email = Column(String, nullable=False)
+    sender = Column(String)
+    text = Column(Text)
+    time = Column(String)
+    __table_args__ = (Index("ix_chat_history_email_id", "email", "id"),)
+
 Base.metadata.create_all(engine)
 
-def log_prompt(prompt_text):
-    with open(PROMPT_LOG_PATH, "a", encoding="utf-8") as f:
-        f.write("\n" + "=" * 40 + "\n")
-        f.write(f"PROMPT TIME: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(prompt_text + "\n")
+prompt_logger = PromptLogger(
+    PROMPT_LOG_PATH,
+    max_bytes=PROMPT_LOG_MAX_BYTES,
+    backup_count=PROMPT_LOG_BACKUPS,
+    queue_size=PROMPT_LOG_QUEUE_SIZE,
+    sample_rate=PROMPT_LOG_SAMPLE_RATE,
+)
 
-def save_to_db(question, answer):
+def save_semantic_to_db(question, vector, answer, evicted=()):
     session = Session()
-    entry = QACache(question=question, answer=answer)
-    session.merge(entry)
+    session.merge(QASemanticCache(
+        question=question,
+        embedding=json.dumps(list(vector)),
+        answer=answer,
+        created_at=time.time(),
+    ))
+    if evicted:
+        session.query(QASemanticCache).filter(QASemanticCache.question.in_(list(evicted))).delete(synchronize_session=False)
     session.commit()
     session.close()
 
-def load_cache_from_db():
+def delete_semantic_from_db(questions):
     session = Session()
-    entries = session.query(QACache).all()
+    session.query(QASemanticCache).filter(QASemanticCache.question.in_(list(questions))).delete(synchronize_session=False)
+    session.commit()
     session.close()
-    return {entry.question.lower(): entry.answer for entry in entries}
 
-qa_cache = load_cache_from_db()
+semantic_watermark = 0.0  # newest created_at loaded from qa_semantic_cache
+
+def load_semantic_entries(cache, since=None):
+    global semantic_watermark
+    session = Session()
+    query = session.query(QASemanticCache)
+    if since is not None:
+        query = query.filter(QASemanticCache.created_at > since)
+    entries = query.order_by(QASemanticCache.created_at).all()
+    session.close()
+    for entry in entries:
+        if entry.question not in cache:
+            cache.add(entry.question, json.loads(entry.embedding), entry.answer, entry.created_at)
+        semantic_watermark = max(semantic_watermark, entry.created_at or 0.0)
+
+def load_semantic_cache_from_db():
+    cache = SemanticCache(
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        max_size=SEMANTIC_CACHE_MAX_SIZE,
+        ttl=SEMANTIC_CACHE_TTL,
+    )
+    load_semantic_entries(cache)
+    return cache
+
+def sync_semantic_cache(cleared: bool):
+    """Runs on the answer store's writer thread after each cross-worker sync."""
+    if semantic_cache is None:
+        return
+    if cleared:
+        semantic_cache.clear()
+    load_semantic_entries(semantic_cache, since=semantic_watermark)
+
+def create_answer_backend():
+    if CACHE_BACKEND == "redis":
+        return RedisAnswerBackend.from_url(REDIS_URL)
+    return SQLiteAnswerBackend(Session, QACache, CacheMeta)
+
+qa_cache = AnswerStore(
+    create_answer_backend(),
+    max_size=QA_CACHE_MAX_SIZE,
+    flush_interval=QA_CACHE_FLUSH_INTERVAL,
+    sync_interval=CACHE_SYNC_INTERVAL,
+    on_sync=sync_semantic_cache,
+)
 
 class User(BaseModel):
     email: str
@@ -70,27 +226,210 @@ class User(BaseModel):
 
 class Query(BaseModel):
     prompt: str
+    include_timings: bool = False
+    # optional retrieval filters; dates are YYYY-MM-DD
+    company: Optional[str] = None
+    file_type: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
 
 class ChatMessage(BaseModel):
     sender: str
     text: str
     time: str
 
-users_db = {}
-chat_history_db = {}
+def hash_password(password, salt=None):
+    """scrypt with a per-user salt, stored as ``scrypt$<salt hex>$<hash hex>``."""
+    salt = salt or os.urandom(16)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=2 ** 14, r=8, p=1)
+    return f"scrypt${salt.hex()}${digest.hex()}"
 
-embedding_model = OllamaEmbeddings(model=OLLAMA_EMBEDDING_MODEL)
-#llm = OllamaLLM(model=OLLAMA_LLM_MODEL)
-llm = ChatOpenAI(model="deepseek/deepseek-r1-0528-qwen3-8b:free", temperature=0)
-db = Chroma(persist_directory=DB_DIR, embedding_function=embedding_model)
+def verify_password(stored, password):
+    if not stored.startswith("scrypt$"):
+        # rows registered before passwords were hashed
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    _, salt, _ = stored.split("$")
+    return hmac.compare_digest(stored, hash_password(password, bytes.fromhex(salt)))
 
-def generate_keywords(user_question: str):
-    prompt = f"""Extract only the key technical terms from this user question.
-Return them in JSON format as a list of strings, like: {{"keywords": ["..."]}}.
-
-Question: {user_question}
-"""
-    response = llm.invoke(prompt)
+def create_user(email, password):
+    session = Session()
+    try:
+        session.add(UserAccount(email=email, password=hash_password(password)))
+        session.commit()
+        return True
+    except IntegrityError:
+        session.rollback()
+        return False
+    finally:
+        session.close()
+
+def check_login(email, password):
+    """None if the email is unknown, else whether the password matches.
+
+    A legacy plaintext password is replaced by its hash on a successful login.
+    """
+    session = Session()
+    try:
+        user = session.get(UserAccount, email)
+        if user is None:
+            return None
+        if not verify_password(user.password, password):
+            return False
+        if not user.password.startswith("scrypt$"):
+            user.password = hash_password(password)
+            session.commit()
+        return True
+    finally:
+        session.close()
+
+chat_history_db = ChatHistoryStore(Session, ChatHistory, retention=CHAT_HISTORY_RETENTION)
+
+llm_clients = {
+    # clients are built once and reused so their HTTP connections are pooled
+    "remote": lambda: ChatOpenAI(model=OPENROUTER_MODEL, temperature=0, timeout=LLM_TIMEOUT, max_retries=0),
+    # the HTTP timeout also ends worker threads whose call the router abandoned
+    "local": lambda: OllamaLLM(model=OLLAMA_LLM_MODEL, client_kwargs={"timeout": LLM_TIMEOUT}),
+}
+keyword_memo = KeywordMemo()
+
+# Heavy components are built by load_components() in a background startup
+# task, so importing the module stays cheap and cannot fail on a missing
+# vector store or model server; /readyz reports when they are usable.
+semantic_cache = None
+embedding_model = None
+llm_router = None
+db = None
+keyword_extractor = None
+bm25_index = None
+dedup_copies = {}  # canonical chunk id -> metadata of its deduplicated copies
+readiness = {"ready": False, "error": None, "startup_ms": None}
+startup_task = None
+startup_attempted = None  # asyncio.Event set after each startup attempt
+
+def create_embeddings():
+    return OllamaEmbeddings(model=OLLAMA_EMBEDDING_MODEL)
+
+def load_components():
+    global semantic_cache, embedding_model, llm_router, db, keyword_extractor, bm25_index, dedup_copies
+    semantic_cache = load_semantic_cache_from_db()
+    embedding_model = CachedEmbeddings(
+        create_embeddings(),
+        max_size=EMBEDDING_CACHE_SIZE,
+        batch_window_ms=EMBEDDING_BATCH_WINDOW_MS,
+    )
+    llm_router = LLMRouter(
+        [LLMBackend(name, llm_clients[name](), timeout=LLM_TIMEOUT) for name in LLM_BACKENDS],
+        hedge=LLM_HEDGE,
+        hedge_percentile=LLM_HEDGE_PERCENTILE,
+        hedge_slots=LLM_HEDGE_SLOTS,
+        route_counter=llm_routes,
+        latency_histogram=llm_backend_latency,
+        max_concurrency=LLM_CONCURRENCY,
+    )
+    if VECTOR_BACKEND == "mmap":
+        db = open_mmap_index(DB_DIR, embedding_model, nprobe=MMAP_NPROBE)
+        if db is None:
+            raise RuntimeError(f"No memory-mapped index in {DB_DIR}; run process.py with VECTOR_BACKEND=mmap")
+    else:
+        db = Chroma(persist_directory=DB_DIR, embedding_function=embedding_model)
+    keyword_extractor = KeywordExtractor.from_db_dir(DB_DIR)
+    bm25_index = BM25Index.load(DB_DIR) if HYBRID_RETRIEVAL else None
+    dedup_copies = load_copies(DB_DIR)
+
+def warmup():
+    """One embedding and one tiny retrieval, so the first user request is not a cold start."""
+    get_tokenizer()
+    embedding_model.embed_query("warmup")
+    hybrid_search(db, bm25_index, "warmup", k=1)
+
+async def start_components():
+    """Load the components, retrying with exponential backoff until they come up.
+
+    A transient failure (e.g. Ollama still booting) must not leave the
+    worker unready for good: /readyz is polled, but nothing else would
+    trigger another attempt.
+    """
+    start = time.perf_counter()
+    delay = 1.0
+    while True:
+        try:
+            await run_in_threadpool(load_components)
+            if WARMUP_ON_STARTUP:
+                await run_in_threadpool(warmup)
+            break
+        except Exception as e:
+            readiness["error"] = str(e)
+            startup_attempted.set()
+            print(f"Error starting RAG components, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+    readiness.update(ready=True, error=None, startup_ms=elapsed_ms(start))
+    startup_attempted.set()
+
+def restart_startup_if_stopped():
+    global startup_task, startup_attempted
+    if not readiness["ready"] and (startup_task is None or startup_task.done()):
+        startup_attempted = asyncio.Event()
+        startup_task = asyncio.ensure_future(start_components())
+
+@app.on_event("startup")
+async def schedule_startup():
+    restart_startup_if_stopped()
+
+async def ensure_ready():
+    if readiness["ready"]:
+        return
+    restart_startup_if_stopped()
+    # wait for the first attempt only; retries after a failure run in the background
+    await startup_attempted.wait()
+    if not readiness["ready"]:
+        raise HTTPException(status_code=503, detail=f"RAG servisi hazır değil: {readiness['error']}")
+
+# The semaphore queues a burst of requests before their LLM deadline starts;
+# the router's own thread pool caps upstream calls, abandoned ones included.
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+# normalized question -> task running its pipeline, shared by identical requests
+inflight_questions = {}
+# same key -> TokenFeed of the run, when that run is streamed
+inflight_feeds = {}
+
+def normalize_question(text: str) -> str:
+    return " ".join(text.strip().lower().split())
+
+def count_llm_tokens(prompt: str, response: str):
+    llm_tokens.inc(count_tokens(prompt), kind="prompt")
+    llm_tokens.inc(count_tokens(response), kind="response")
+
+async def call_llm(prompt: str, call: str = "answer"):
+    async with llm_semaphore:
+        try:
+            text = await llm_router.ainvoke(prompt)
+        except Exception:
+            llm_errors.inc(call=call)
+            raise
+    await run_in_threadpool(count_llm_tokens, prompt, text)
+    return text
+
+async def stream_llm(prompt: str):
+    """Yield answer tokens as the LLM produces them.
+
+    The router drains the blocking stream in a worker thread, holds every
+    chunk to the backend's deadline and falls back to the next backend if
+    the first one fails before sending anything.
+    """
+    parts = []
+    async with llm_semaphore:
+        try:
+            async for text in llm_router.astream(prompt):
+                parts.append(text)
+                yield text
+        except Exception:
+            llm_errors.inc(call="stream")
+            raise
+        finally:
+            await run_in_threadpool(count_llm_tokens, prompt, "".join(parts))
+
+def parse_keywords(response, user_question: str):
     try:
         json_start = response.find('{')
         json_end = response.rfind('}') + 1
@@ -98,13 +437,39 @@ Question: {user_question}
         data = json.loads(json_str)
         keywords = data.get("keywords", [])
     except Exception:
-        keywords = re.findall(r'\b\w{4,}\b', user_question.lower())[:3]
+        keywords = fallback_keywords(user_question)
     return keywords
 
-def create_prompt_with_context(question: str, keywords, k=3):
+async def generate_keywords(user_question: str):
+    keywords = keyword_memo.get(user_question)
+    if keywords is not None:
+        return keywords
+
+    if KEYWORD_MODE == "local" and keyword_extractor:
+        keywords = keyword_extractor.extract(user_question)
+    else:
+        prompt = f"""Extract only the key technical terms from this user question.
+Return them in JSON format as a list of strings, like: {{"keywords": ["..."]}}.
+
+Question: {user_question}
+"""
+        response = await call_llm(prompt, call="keywords")
+        keywords = parse_keywords(response, user_question)
+    if not keywords:
+        keywords = fallback_keywords(user_question)
+
+    keyword_memo.put(user_question, keywords)
+    return keywords
+
+def create_prompt_with_context(question: str, keywords, k=RETRIEVAL_CANDIDATES, filters=None):
     keyword_str = " ".join(keywords)
-    docs = db.similarity_search(keyword_str, k=k)
-    context = "\n\n".join([doc.page_content for doc in docs])
+    docs = hybrid_search(db, bm25_index, keyword_str, k=k, filters=filters, copies=dedup_copies)
+    passages, context_stats = pack_context(
+        f"{question} {keyword_str}",
+        [doc.page_content for doc in docs],
+        CONTEXT_TOKEN_BUDGET,
+    )
+    context = "\n\n".join(passages)
     
     prompt = f"""
 You are an expert API documentation assistant. Based only on the relevant documentation chunks and keywords provided, answer as technically and accurately as possible.
@@ -125,79 +490,385 @@ Relevant Documentation Chunks:
 Keywords:
 {', '.join(keywords)}
 """
-    return prompt
+    return prompt, context_stats
 
 
 @app.post("/register")
 async def register(user: User):
-    if user.email in users_db:
+    if not await run_in_threadpool(create_user, user.email, user.password):
         raise HTTPException(status_code=400, detail="Email already registered")
-    users_db[user.email] = user.password
     return {"message": "User registered successfully"}
 
 @app.post("/login")
 async def login(user: User):
-    stored_password = users_db.get(user.email)
-    if not stored_password:
+    matched = await run_in_threadpool(check_login, user.email, user.password)
+    if matched is None:
         raise HTTPException(status_code=404, detail="Email not found")
-    if stored_password != user.password:
+    if not matched:
         raise HTTPException(status_code=400, detail="Incorrect password")
     return {"message": "Login successful"}
 
 @app.post("/chat/{email}")
 async def save_chat_message(email: str, message: ChatMessage):
-    if email not in chat_history_db:
-        chat_history_db[email] = []
-    chat_history_db[email].append(message.dict())
+    chat_history_db.append(email, message.dict())
     return {"message": "Mesaj kaydedildi"}
 
 @app.get("/chat/{email}")
-async def get_chat_history(email: str):
-    return {"history": chat_history_db.get(email, [])}
+async def get_chat_history(email: str, before: Optional[int] = None, limit: int = 50):
+    limit = max(1, min(limit, CHAT_PAGE_MAX_LIMIT))
+    history, next_before = await run_in_threadpool(chat_history_db.page, email, before, limit)
+    return {"history": history, "next_before": next_before}
 
 @app.get("/cache")
-async def get_cache():
-    return load_cache_from_db()
+async def get_cache(cursor: Optional[str] = None, limit: int = 100):
+    limit = max(1, min(limit, CACHE_PAGE_MAX_LIMIT))
+    await run_in_threadpool(qa_cache.flush)
+
+    def stream_page():
+        yield '{"entries": ['
+        last_question = None
+        count = 0
+        for question, answer in qa_cache.iter_page(cursor, limit):
+            if count:
+                yield ","
+            yield json.dumps({"question": question, "answer": answer}, ensure_ascii=False)
+            last_question = question
+            count += 1
+        next_cursor = last_question if count == limit else None
+        yield '], "next_cursor": ' + json.dumps(next_cursor, ensure_ascii=False) + "}"
+
+    return StreamingResponse(stream_page(), media_type="application/json")
+
 @app.delete("/cache")
 async def clear_cache():
-    qa_cache.clear()
+    # semantic rows go first: the qa_cache clear bumps the generation other
+    # workers watch, and they must not reload semantic entries afterwards
     session = Session()
-    session.query(QACache).delete()
+    session.query(QASemanticCache).delete()
     session.commit()
     session.close()
+    if semantic_cache is not None:
+        semantic_cache.clear()
+    await run_in_threadpool(qa_cache.clear)
     return {"message": "Cache temizlendi."}
 
+@app.on_event("shutdown")
+def flush_caches():
+    qa_cache.close()
+    chat_history_db.close()
+    prompt_logger.close()
+
+async def embed_question(question: str):
+    return await run_in_threadpool(embedding_model.embed_query, question)
+
+def lookup_semantic_cache(vector):
+    """Runs in the threadpool: the purge scan, matrix rebuild and matmul are O(entries)."""
+    expired = semantic_cache.purge_expired()
+    if expired:
+        delete_semantic_from_db(expired)
+    return semantic_cache.lookup(vector)
+
+def add_to_semantic_cache(question, vector, answer):
+    evicted = semantic_cache.add(question, vector, answer)
+    save_semantic_to_db(question, vector, answer, evicted)
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def record_stage(timings: dict, stage: str, start: float):
+    ms = elapsed_ms(start)
+    timings[f"{stage}_ms"] = ms
+    stage_latency.observe(ms / 1000, stage=stage)
+
+def get_filters(query: Query):
+    try:
+        return build_filters(query.company, query.file_type, query.date_from, query.date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def cache_key(question: str, filters) -> str:
+    """Scoped answers are cached under the question plus its filters."""
+    if not filters:
+        return question
+    return f"{question} | {json.dumps(filters, sort_keys=True)}"
+
+async def lookup_cached_answer(question: str, timings: dict, filters=None):
+    """Return ``(answer, cache_hit, similarity, vector)``; answer is None on a miss.
+
+    Filtered questions only use the exact cache: a semantic match could be
+    an answer drawn from another company's documents.
+    """
+    key = cache_key(question, filters)
+    start = time.perf_counter()
+    cached_answer = qa_cache.peek(key)
+    if cached_answer is None:
+        cached_answer = await run_in_threadpool(qa_cache.get, key)
+    record_stage(timings, "exact_cache", start)
+    if cached_answer is not None:
+        return cached_answer, "exact", 1.0, None
+    if filters:
+        return None, None, None, None
+
+    start = time.perf_counter()
+    vector = await embed_question(question)
+    record_stage(timings, "embedding", start)
+    start = time.perf_counter()
+    match = await run_in_threadpool(lookup_semantic_cache, vector)
+    record_stage(timings, "semantic_cache", start)
+    if match:
+        _, answer, score = match
+        return answer, "semantic", score, vector
+    return None, None, None, vector
+
+async def prepare_prompt(question: str, timings: dict, filters=None):
+    start = time.perf_counter()
+    keywords = await generate_keywords(question)
+    record_stage(timings, "keywords", start)
+    start = time.perf_counter()
+    rag_prompt, context_stats = await run_in_threadpool(
+        create_prompt_with_context, question, keywords, filters=filters)
+    record_stage(timings, "retrieval", start)
+    return rag_prompt, context_stats
+
+async def store_answer(question: str, vector, answer: str, timings: dict, filters=None):
+    start = time.perf_counter()
+    qa_cache.put(cache_key(question, filters), answer)
+    if not filters:
+        await run_in_threadpool(add_to_semantic_cache, question, vector, answer)
+    record_stage(timings, "store", start)
+
+async def run_pipeline(question: str, vector, filters=None):
+    timings = {}
+    rag_prompt, context_stats = await prepare_prompt(question, timings, filters)
+    start = time.perf_counter()
+    answer = await call_llm(rag_prompt)
+    record_stage(timings, "llm", start)
+    await store_answer(question, vector, answer, timings, filters)
+    return {
+        "answer": answer,
+        "used_prompt": rag_prompt,
+        "context_tokens": context_stats,
+        "timings": timings,
+    }
+
+class TokenFeed:
+    """Tokens of one streamed run, replayed from the start to every stream that joins it."""
+
+    def __init__(self):
+        self.tokens = []
+        self.closed = False
+        self.changed = asyncio.Event()
+
+    def push(self, token: str):
+        self.tokens.append(token)
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def follow(self):
+        sent = 0
+        while True:
+            while sent < len(self.tokens):
+                yield self.tokens[sent]
+                sent += 1
+            if self.closed:
+                return
+            await self.changed.wait()
+
+async def run_stream_pipeline(question: str, vector, feed: TokenFeed, filters=None):
+    """run_pipeline with the answer streamed into ``feed`` as it is generated."""
+    timings = {}
+    try:
+        rag_prompt, context_stats = await prepare_prompt(question, timings, filters)
+        parts = []
+        start = time.perf_counter()
+        async for token in stream_llm(rag_prompt):
+            parts.append(token)
+            feed.push(token)
+        record_stage(timings, "llm", start)
+        answer = "".join(parts)
+        await store_answer(question, vector, answer, timings, filters)
+    finally:
+        feed.close()
+    return {
+        "answer": answer,
+        "used_prompt": rag_prompt,
+        "context_tokens": context_stats,
+        "timings": timings,
+    }
+
+def start_pipeline(key: str, pipeline):
+    task = asyncio.ensure_future(pipeline)
+    inflight_questions[key] = task
+    def forget(_):
+        inflight_questions.pop(key, None)
+        inflight_feeds.pop(key, None)
+    task.add_done_callback(forget)
+    return task
+
+def get_or_start_pipeline(question: str, vector, filters=None):
+    key = cache_key(question, filters)
+    task = inflight_questions.get(key)
+    if task is None:
+        task = start_pipeline(key, run_pipeline(question, vector, filters))
+    return task
+
+def get_or_start_stream(question: str, vector, filters=None):
+    """Return ``(task, feed)``; feed is None when the shared run is a non-streamed /ask."""
+    key = cache_key(question, filters)
+    task = inflight_questions.get(key)
+    if task is None:
+        feed = inflight_feeds[key] = TokenFeed()
+        task = start_pipeline(key, run_stream_pipeline(question, vector, feed, filters))
+    return task, inflight_feeds.get(key)
+
+def log_request(request_id: str, question: str, cache_hit, timings: dict,
+                rag_prompt: Optional[str] = None, **extra):
+    prompt_logger.log({
+        "request_id": request_id,
+        "question": question,
+        "cache_hit": cache_hit,
+        "timings": timings,
+        **extra,
+    }, prompt=rag_prompt)
+
 @app.post("/ask")
 async def ask(query: Query):
-    question = query.prompt.strip().lower()
-    if question in qa_cache:
-        return {
-            "answer": qa_cache[question],
-            "cached": True,
-            "used_prompt": None  
-        }
-
+    await ensure_ready()
+    request_id = uuid.uuid4().hex
+    question = normalize_question(query.prompt)
+    filters = get_filters(query)
+    start = time.perf_counter()
+    timings = {}
+    requests_in_flight.inc(endpoint="/ask")
     try:
-        keywords = generate_keywords(question)
-        rag_prompt = create_prompt_with_context(question, keywords)
-
-        log_prompt(rag_prompt)
-        
-        print("\n" + "="*40)
-        print( "Prompt sent to LLM:")
-        print(rag_prompt)
-        print("="*40 + "\n")
-
-        answer = llm.invoke(rag_prompt)
-        qa_cache[question] = answer
-        save_to_db(question.lower(), answer)
-        return {
-            "answer": answer,
-            "cached": False,
-            "used_prompt": rag_prompt 
-        }
+        answer, cache_hit, similarity, vector = await lookup_cached_answer(question, timings, filters)
+        cache_requests.inc(result=cache_hit or "miss")
+        if answer is not None:
+            timings["total_ms"] = elapsed_ms(start)
+            log_request(request_id, question, cache_hit, timings, similarity=similarity, filters=filters)
+            response = {
+                "answer": answer,
+                "cached": True,
+                "cache_hit": cache_hit,
+                "similarity": similarity,
+                "used_prompt": None,
+                "request_id": request_id
+            }
+        else:
+            # shield: a client that disconnects must not cancel the run other
+            # requests for the same question are waiting on
+            result = await asyncio.shield(get_or_start_pipeline(question, vector, filters))
+            timings.update(result["timings"])
+            timings["total_ms"] = elapsed_ms(start)
+            log_request(request_id, question, None, timings, result["used_prompt"],
+                        context_tokens=result["context_tokens"], filters=filters)
+            response = {
+                "answer": result["answer"],
+                "cached": False,
+                "cache_hit": None,
+                "similarity": None,
+                "used_prompt": result["used_prompt"],
+                "context_tokens": result["context_tokens"],
+                "request_id": request_id
+            }
+        if query.include_timings:
+            response["timings"] = timings
+        return response
     except Exception as e:
+        log_request(request_id, question, None, timings, error=str(e), filters=filters)
         return {"error": f"Hata oluştu: {str(e)}"}
+    finally:
+        requests_in_flight.dec(endpoint="/ask")
+        request_latency.observe(time.perf_counter() - start, endpoint="/ask")
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_stream(query: Query):
+    await ensure_ready()
+    request_id = uuid.uuid4().hex
+    question = normalize_question(query.prompt)
+    filters = get_filters(query)
+
+    async def events():
+        start = time.perf_counter()
+        requests_in_flight.inc(endpoint="/ask/stream")
+        try:
+            async for chunk in stream_events():
+                yield chunk
+        finally:
+            requests_in_flight.dec(endpoint="/ask/stream")
+            request_latency.observe(time.perf_counter() - start, endpoint="/ask/stream")
+
+    async def stream_events():
+        start = time.perf_counter()
+        first_token_at = None
+        timings = {}
+        rag_prompt = None
+        done = {"cached": False, "cache_hit": None, "similarity": None, "request_id": request_id}
+        try:
+            answer, cache_hit, similarity, vector = await lookup_cached_answer(question, timings, filters)
+            cache_requests.inc(result=cache_hit or "miss")
+            if answer is not None:
+                first_token_at = time.perf_counter()
+                done.update(cached=cache_hit is not None, cache_hit=cache_hit, similarity=similarity)
+                yield sse_event("token", {"text": answer})
+            else:
+                # identical streams and /ask requests share one run; the run is
+                # a task, so a disconnecting client does not cancel it for the others
+                task, feed = get_or_start_stream(question, vector, filters)
+                if feed is not None:
+                    async for token in feed.follow():
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        yield sse_event("token", {"text": token})
+                result = await asyncio.shield(task)
+                if feed is None:
+                    first_token_at = time.perf_counter()
+                    yield sse_event("token", {"text": result["answer"]})
+                rag_prompt = result["used_prompt"]
+                done["context_tokens"] = result["context_tokens"]
+                timings.update(result["timings"])
+        except Exception as e:
+            log_request(request_id, question, None, timings, rag_prompt, error=str(e), stream=True, filters=filters)
+            yield sse_event("error", {"error": f"Hata oluştu: {str(e)}"})
+            return
+
+        timings["time_to_first_token_ms"] = round((first_token_at - start) * 1000, 2) if first_token_at else None
+        timings["total_ms"] = elapsed_ms(start)
+        done["timings"] = timings
+        log_request(request_id, question, done["cache_hit"], timings, rag_prompt, stream=True, filters=filters)
+        yield sse_event("done", done)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    if not readiness["ready"]:
+        restart_startup_if_stopped()
+        status = "starting" if readiness["error"] is None else "retrying"
+        return JSONResponse(status_code=503, content={"status": status, **readiness})
+    return {"status": "ready", **readiness}
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def root():
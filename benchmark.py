@@ -0,0 +1,208 @@
+"""Offline load test for the FastAPI app in api.py.
+
+Runs the real app in-process with deterministic stand-ins for the LLM and
+embedding backends and a synthetic Chroma corpus, so no OpenRouter quota or
+Ollama server is needed. Results go to a JSON file that can be diffed
+between versions:
+
+    python benchmark.py --requests 200 --concurrency 16 --output bench.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List
+
+from langchain_core.embeddings import Embeddings
+
+WORDS = (
+    "order orders payment invoice customer endpoint token limit offset status "
+    "disclosure company report quarter balance revenue share dividend board "
+    "request response header parameter json error retry timeout account user "
+    "create update delete list filter sort page cursor webhook event schema"
+).split()
+
+
+class StubEmbeddings(Embeddings):
+    """Hashing-trick bag-of-words vectors with a fixed per-call latency."""
+
+    def __init__(self, dim: int = 384, latency_ms: float = 5):
+        self.dim = dim
+        self.latency = latency_ms / 1000
+
+    def _vector(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        for word in text.lower().split():
+            h = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+            vec[h % self.dim] += 1.0 if (h >> 64) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class StubLLM:
+    """Deterministic LLM stand-in: fixed first-token latency, then a token rate."""
+
+    def __init__(self, latency_ms: float = 300, tokens_per_second: float = 50, answer_tokens: int = 60):
+        self.latency = latency_ms / 1000
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+
+    def _tokens(self, prompt: str) -> List[str]:
+        if "JSON format" in prompt:
+            words = [w for w in prompt.lower().split() if w in WORDS][:3] or ["endpoint"]
+            return [json.dumps({"keywords": words})]
+        rng = random.Random(hashlib.md5(prompt.encode("utf-8")).hexdigest())
+        return [rng.choice(WORDS) + " " for _ in range(self.answer_tokens)]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        time.sleep(self.latency)
+        for token in self._tokens(prompt):
+            time.sleep(1 / self.tokens_per_second)
+            yield token
+
+    def invoke(self, prompt: str) -> str:
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return "".join(tokens)
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def build_corpus(db_dir: str, size: int, embeddings: Embeddings, seed: int = 0):
+    from langchain_chroma import Chroma
+    from keywords import build_vocabulary, save_vocabulary
+    from retrieval import BM25Index
+
+    rng = random.Random(seed)
+    texts = [random_text(rng, 200) for _ in range(size)]
+    ids = [f"chunk-{i}" for i in range(size)]
+    metadatas = [{"source": f"synthetic/{i // 10}.txt"} for i in range(size)]
+    Chroma.from_texts(texts, embeddings, metadatas=metadatas, ids=ids, persist_directory=db_dir)
+    save_vocabulary(build_vocabulary(texts), db_dir)
+    bm25 = BM25Index()
+    for chunk_id, text, metadata in zip(ids, texts, metadatas):
+        bm25.add(chunk_id, text, metadata)
+    bm25.save(db_dir)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "rps": round((len(latencies) + errors) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+async def drive(client, requests: List[tuple], concurrency: int) -> Dict:
+    """Send (method, url, json) requests with at most ``concurrency`` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(method, url, body):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200 or "error" in response.json():
+                errors += 1
+            else:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*request) for request in requests))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(args) -> Dict:
+    import httpx
+    import api
+
+    embeddings = StubEmbeddings(latency_ms=args.embed_latency_ms)
+    api.DB_DIR = os.path.join(args.workdir, "rag_db")
+    build_corpus(api.DB_DIR, args.corpus_size, embeddings)
+    api.create_embeddings = lambda: embeddings
+    api.llm_clients = {
+        name: (lambda: StubLLM(args.llm_latency_ms, args.tokens_per_second))
+        for name in api.LLM_BACKENDS
+    }
+    await api.ensure_ready()
+
+    rng = random.Random(1)
+    results = {}
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        hot_question = "what does the orders endpoint return"
+        await client.post("/ask", json={"prompt": hot_question})
+        results["cache_hit"] = await drive(
+            client, [("POST", "/ask", {"prompt": hot_question})] * args.requests, args.concurrency)
+
+        cold = [("POST", "/ask", {"prompt": f"{random_text(rng, 6)} {i}"}) for i in range(args.cold_requests)]
+        results["cold"] = await drive(client, cold, args.concurrency)
+
+        message = {"sender": "user", "text": "merhaba", "time": "12:00"}
+        writes = [("POST", f"/chat/user{i % 20}@bench", message) for i in range(args.requests)]
+        results["chat_write"] = await drive(client, writes, args.concurrency)
+        reads = [("GET", f"/chat/user{i % 20}@bench?limit=50", None) for i in range(args.requests)]
+        results["chat_read"] = await drive(client, reads, args.concurrency)
+
+    api.flush_caches()
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_rss_mb"] = round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    results["config"] = {k: v for k, v in vars(args).items() if k != "workdir"}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline /ask and /chat load test")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per hit-path/chat scenario")
+    parser.add_argument("--cold-requests", type=int, default=40, help="Requests for the uncached path")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--corpus-size", type=int, default=1000, help="Synthetic chunks in the vector DB")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--embed-latency-ms", type=float, default=5)
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        # must be set before api is imported: they pick the cache DB and log dir
+        os.environ["CACHE_DB_URL"] = f"sqlite:///{os.path.join(workdir, 'cache.db')}"
+        os.environ["LOG_DIR"] = os.path.join(workdir, "logs")
+        results = asyncio.run(run(args))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import hashlib
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class BulkEmbedder(Embeddings):
+    """Embedding client for bulk indexing.
+
+    Texts are sent in batches of ``batch_size`` with up to ``max_in_flight``
+    batches running at once; failed batches are retried with exponential
+    backoff. Vectors are cached on disk by a hash of model and chunk text,
+    so boilerplate repeated across filings is only embedded once, even
+    across runs.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_path: Optional[str] = None, batch_size: int = 32,
+                 max_in_flight: int = 4, retries: int = 5, backoff: float = 1.0):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = None
+        if cache_path:
+            self.cache = sqlite3.connect(cache_path)
+            self.cache.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.embedded = 0
+        self.cached = 0
+        self.started = time.perf_counter()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        if self.cache is None or not keys:
+            return {}
+        found = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows = self.cache.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part)
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, vectors: dict):
+        if self.cache is None or not vectors:
+            return
+        self.cache.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(key, array("f", vector).tobytes()) for key, vector in vectors.items()])
+        self.cache.commit()
+
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._lookup(list(dict.fromkeys(keys)))
+        self.cached += sum(1 for key in keys if key in vectors)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        batches = [missing_keys[i:i + self.batch_size] for i in range(0, len(missing_keys), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            results = executor.map(lambda batch: self._embed_with_retry([missing[k] for k in batch]), batches)
+            fresh = {}
+            for batch, batch_vectors in zip(batches, results):
+                fresh.update(zip(batch, batch_vectors))
+        self._store(fresh)
+        vectors.update(fresh)
+
+        self.embedded += len(texts)
+        elapsed = time.perf_counter() - self.started
+        rate = self.embedded / elapsed if elapsed else 0.0
+        print(f"Embedded {self.embedded} chunks ({self.cached} from cache), {rate:.1f} chunks/s")
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
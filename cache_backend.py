@@ -0,0 +1,115 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+GENERATION_KEY = "qa_cache_generation"
+
+
+class SQLiteAnswerBackend:
+    """Answer cache shared by every worker through the SQLite (WAL) database.
+
+    ``clear`` bumps a generation counter in the meta table; workers poll it
+    to drop their near-caches when another worker clears the cache.
+    """
+
+    def __init__(self, session_factory, model, meta_model):
+        self.Session = session_factory
+        self.model = model
+        self.meta_model = meta_model
+
+    def get(self, question: str) -> Optional[str]:
+        session = self.Session()
+        try:
+            entry = session.get(self.model, question)
+            return entry.answer if entry else None
+        finally:
+            session.close()
+
+    def set_many(self, entries: Dict[str, str]):
+        session = self.Session()
+        try:
+            for question, answer in entries.items():
+                session.merge(self.model(question=question, answer=answer))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def clear(self):
+        session = self.Session()
+        try:
+            session.query(self.model).delete()
+            meta = session.get(self.meta_model, GENERATION_KEY)
+            if meta is None:
+                session.add(self.meta_model(key=GENERATION_KEY, value=1))
+            else:
+                meta.value += 1
+            session.commit()
+        finally:
+            session.close()
+
+    def generation(self) -> int:
+        session = self.Session()
+        try:
+            meta = session.get(self.meta_model, GENERATION_KEY)
+            return meta.value if meta else 0
+        finally:
+            session.close()
+
+    def iter_page(self, cursor: Optional[str] = None, limit: int = 100) -> Iterator[Tuple[str, str]]:
+        session = self.Session()
+        try:
+            query = session.query(self.model.question, self.model.answer)
+            if cursor is not None:
+                query = query.filter(self.model.question > cursor)
+            for question, answer in query.order_by(self.model.question).limit(limit).yield_per(100):
+                yield question, answer
+        finally:
+            session.close()
+
+
+class RedisAnswerBackend:
+    """Answer cache in a Redis-compatible server.
+
+    Answers live in one hash; a sorted set of questions (all score 0) gives
+    lexicographic cursor pagination. Any client exposing the redis-py API
+    works, so a local stand-in can replace the server in tests.
+    """
+
+    def __init__(self, client, prefix: str = "rag"):
+        self.client = client
+        self.answers_key = f"{prefix}:qa"
+        self.index_key = f"{prefix}:qa:questions"
+        self.generation_key = f"{prefix}:{GENERATION_KEY}"
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisAnswerBackend":
+        import redis
+        return cls(redis.Redis.from_url(url, decode_responses=True), **kwargs)
+
+    def get(self, question: str) -> Optional[str]:
+        return self.client.hget(self.answers_key, question)
+
+    def set_many(self, entries: Dict[str, str]):
+        pipe = self.client.pipeline()
+        pipe.hset(self.answers_key, mapping=entries)
+        pipe.zadd(self.index_key, {question: 0 for question in entries})
+        pipe.execute()
+
+    def clear(self):
+        pipe = self.client.pipeline()
+        pipe.delete(self.answers_key, self.index_key)
+        pipe.incr(self.generation_key)
+        pipe.execute()
+
+    def generation(self) -> int:
+        return int(self.client.get(self.generation_key) or 0)
+
+    def iter_page(self, cursor: Optional[str] = None, limit: int = 100) -> Iterator[Tuple[str, str]]:
+        start = "(" + cursor if cursor is not None else "-"
+        questions = self.client.zrangebylex(self.index_key, start, "+", start=0, num=limit)
+        if not questions:
+            return
+        for question, answer in zip(questions, self.client.hmget(self.answers_key, questions)):
+            if answer is not None:
+                yield question, answer
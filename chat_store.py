@@ -0,0 +1,102 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class ChatHistoryStore:
+    """Append-only per-user chat history in SQLite.
+
+    Messages are buffered and inserted in batches by a background thread.
+    Each user keeps at most ``retention`` messages; older ones are pruned
+    after every flush.
+    """
+
+    def __init__(self, session_factory, model, retention: int = 1000,
+                 flush_interval: float = 0.5, batch_size: int = 200):
+        self.Session = session_factory
+        self.model = model
+        self.retention = retention
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._writer, name="chat-history-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, email: str, message: Dict):
+        with self.lock:
+            self.pending.append((email, message))
+            if len(self.pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def _writer(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing chat history: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            session = self.Session()
+            try:
+                session.add_all([self.model(email=email, **message) for email, message in batch])
+                session.flush()
+                for email in {email for email, _ in batch}:
+                    self._prune(session, email)
+                session.commit()
+            except Exception:
+                session.rollback()
+                with self.lock:
+                    self.pending = batch + self.pending
+                raise
+            finally:
+                session.close()
+
+    def _prune(self, session, email: str):
+        if not self.retention:
+            return
+        cutoff = (
+            session.query(self.model.id)
+            .filter(self.model.email == email)
+            .order_by(self.model.id.desc())
+            .offset(self.retention - 1)
+            .limit(1)
+            .scalar()
+        )
+        if cutoff is not None:
+            session.query(self.model).filter(
+                self.model.email == email, self.model.id < cutoff
+            ).delete(synchronize_session=False)
+
+    def page(self, email: str, before: Optional[int] = None, limit: int = 50) -> Tuple[List[Dict], Optional[int]]:
+        """Return up to ``limit`` messages older than ``before`` (oldest first) and the next cursor."""
+        self.flush()
+        session = self.Session()
+        try:
+            query = session.query(self.model).filter(self.model.email == email)
+            if before is not None:
+                query = query.filter(self.model.id < before)
+            rows = query.order_by(self.model.id.desc()).limit(limit).all()
+            messages = [
+                {"id": row.id, "sender": row.sender, "text": row.text, "time": row.time}
+                for row in reversed(rows)
+            ]
+        finally:
+            session.close()
+        next_before = messages[0]["id"] if len(messages) == limit else None
+        return messages, next_before
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
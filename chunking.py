@@ -0,0 +1,146 @@
+import re
+from typing import Dict, Iterable, List
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from context_packing import count_tokens
+
+# chunk sizes are tiktoken (cl100k_base) tokens, except for "legacy" which
+# reproduces the original character-based splitter
+PROFILES = {
+    "legacy": {"chunk_chars": 30000, "overlap_chars": 50},
+    "small": {"chunk_tokens": 256, "overlap_tokens": 32},
+    "medium": {"chunk_tokens": 512, "overlap_tokens": 64},
+    "large": {"chunk_tokens": 1024, "overlap_tokens": 128},
+}
+
+HEADING_PATTERN = re.compile(r"^(#{1,6}\s|\[PAGE \d+|[A-ZÇĞİÖŞÜ][A-ZÇĞİÖŞÜ0-9 .:/-]{3,80}$)")
+TABLE_LINE_PATTERN = re.compile(r"\|.*\||\t.*\t")
+
+
+def split_blocks(text: str) -> List[Dict]:
+    """Cut text into structural blocks: headings, whole tables and paragraphs.
+
+    Consecutive table-like lines (pipe- or tab-separated) stay in one block
+    and XML sections come out of extraction separated by blank lines, so
+    neither is cut unless it is larger than a whole chunk.
+    """
+    blocks = []
+    current, kind = [], None
+
+    def close():
+        nonlocal current, kind
+        if current:
+            blocks.append({"kind": kind, "text": "\n".join(current)})
+        current, kind = [], None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            if kind != "table":
+                close()
+            continue
+        if TABLE_LINE_PATTERN.search(line):
+            if kind != "table":
+                close()
+                kind = "table"
+            current.append(line)
+            continue
+        if kind == "table":
+            close()
+        if HEADING_PATTERN.match(stripped) and len(stripped) < 120:
+            close()
+            blocks.append({"kind": "heading", "text": stripped})
+            continue
+        kind = "paragraph"
+        current.append(line)
+    close()
+    return blocks
+
+
+class StructureAwareSplitter:
+    """Token-budgeted splitter that packs whole structural blocks into chunks.
+
+    A heading always starts a new chunk and is repeated at the top of any
+    continuation chunk of the same section. Blocks bigger than a chunk fall
+    back to a token-based recursive split.
+    """
+
+    def __init__(self, profile: str, chunk_tokens: int, overlap_tokens: int):
+        self.profile = profile
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.fallback = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name="cl100k_base",
+            chunk_size=chunk_tokens,
+            chunk_overlap=overlap_tokens,
+        )
+
+    def split_text(self, text: str) -> List[str]:
+        chunks = []
+        heading = None
+        parts, used, has_content = [], 0, False
+
+        def emit():
+            if has_content:
+                chunks.append("\n\n".join(parts))
+
+        def start_section_chunk(tail=None):
+            nonlocal parts, used, has_content
+            parts = [heading] if heading else []
+            used = count_tokens(heading) if heading else 0
+            has_content = False
+            # overlap: carry a short tail block into the next chunk of the same section
+            if tail and count_tokens(tail) <= self.overlap_tokens:
+                parts.append(tail)
+                used += count_tokens(tail)
+
+        for block in split_blocks(text):
+            if block["kind"] == "heading":
+                if has_content:
+                    emit()
+                    parts, used, has_content = [], 0, False
+                heading = block["text"]
+                parts.append(heading)
+                used += count_tokens(heading)
+                continue
+            tokens = count_tokens(block["text"])
+            if tokens > self.chunk_tokens:
+                emit()
+                for piece in self.fallback.split_text(block["text"]):
+                    chunks.append(f"{heading}\n\n{piece}" if heading else piece)
+                start_section_chunk()
+                continue
+            if used + tokens > self.chunk_tokens and has_content:
+                emit()
+                start_section_chunk(parts[-1])
+            parts.append(block["text"])
+            used += tokens
+            has_content = True
+        emit()
+        return chunks
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        chunks = []
+        for doc in documents:
+            for text in self.split_text(doc.page_content):
+                chunks.append(Document(page_content=text, metadata={**doc.metadata, "chunk_profile": self.profile}))
+        return chunks
+
+
+class _LegacySplitter(RecursiveCharacterTextSplitter):
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        chunks = super().split_documents(documents)
+        for chunk in chunks:
+            chunk.metadata["chunk_profile"] = "legacy"
+        return chunks
+
+
+def make_splitter(profile: str):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown chunking profile {profile!r}, expected one of {sorted(PROFILES)}")
+    settings = PROFILES[profile]
+    if "chunk_chars" in settings:
+        return _LegacySplitter(chunk_size=settings["chunk_chars"], chunk_overlap=settings["overlap_chars"])
+    return StructureAwareSplitter(profile, settings["chunk_tokens"], settings["overlap_tokens"])
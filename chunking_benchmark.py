@@ -0,0 +1,109 @@
+"""Offline comparison of chunking profiles.
+
+For every profile the source tree is parsed, split and indexed into an
+in-memory Chroma collection plus a BM25 index, then each question from a
+JSON-lines file is retrieved and packed exactly like /ask does. Reported per
+profile: retrieval hit rate, average packed prompt tokens, chunk count and
+indexing throughput.
+
+Question file format, one object per line; a question is a hit when a
+retrieved chunk comes from a source path containing ``source`` or contains
+the ``answer`` text:
+
+    {"question": "orders endpoint parameters", "source": "api/orders", "answer": "limit"}
+
+    python chunking_benchmark.py SOURCE_DIR questions.jsonl --profiles legacy small medium
+"""
+import argparse
+import json
+import time
+
+from langchain_chroma import Chroma
+
+from chunking import PROFILES, make_splitter
+from context_packing import count_tokens, pack_context
+from process import iter_source_files, make_chunk_ids, process_file
+from retrieval import BM25Index, hybrid_search
+
+
+def load_questions(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_hit(question: dict, docs) -> bool:
+    for doc in docs:
+        if question.get("source") and question["source"] in doc.metadata.get("source", ""):
+            return True
+        if question.get("answer") and question["answer"].lower() in doc.page_content.lower():
+            return True
+    return False
+
+
+def benchmark_profile(profile: str, documents, questions, embeddings, k: int, token_budget: int) -> dict:
+    splitter = make_splitter(profile)
+    start = time.perf_counter()
+    chunks = splitter.split_documents(documents)
+    split_seconds = time.perf_counter() - start
+
+    ids = make_chunk_ids(chunks)
+    start = time.perf_counter()
+    db = Chroma(collection_name=f"chunking_bench_{profile}", embedding_function=embeddings)
+    db.add_documents(chunks, ids=ids)
+    bm25 = BM25Index()
+    bm25.add_documents(ids, chunks)
+    index_seconds = time.perf_counter() - start
+
+    hits, prompt_tokens = 0, 0
+    for question in questions:
+        docs = hybrid_search(db, bm25, question["question"], k=k)
+        hits += is_hit(question, docs)
+        passages, _ = pack_context(question["question"], [doc.page_content for doc in docs], token_budget)
+        prompt_tokens += count_tokens("\n\n".join(passages))
+    db.delete_collection()
+
+    total = split_seconds + index_seconds
+    return {
+        "chunks": len(chunks),
+        "avg_chunk_tokens": round(sum(count_tokens(c.page_content) for c in chunks) / len(chunks), 1) if chunks else 0,
+        "hit_rate": round(hits / len(questions), 3) if questions else None,
+        "avg_prompt_tokens": round(prompt_tokens / len(questions), 1) if questions else None,
+        "split_seconds": round(split_seconds, 2),
+        "index_seconds": round(index_seconds, 2),
+        "chunks_per_second": round(len(chunks) / total, 1) if total else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunking profiles on retrieval quality and cost")
+    parser.add_argument("source_dir", help="Directory with source documents (e.g. one KAP company)")
+    parser.add_argument("questions", help="JSON-lines question set")
+    parser.add_argument("--profiles", nargs="+", default=sorted(PROFILES), choices=sorted(PROFILES))
+    parser.add_argument("--k", type=int, default=8, help="Chunks retrieved per question")
+    parser.add_argument("--token-budget", type=int, default=3000, help="Context token budget, as in api.py")
+    parser.add_argument("--stub-embeddings", action="store_true",
+                        help="Use benchmark.StubEmbeddings instead of Ollama (measures splitting/BM25 only)")
+    parser.add_argument("--output", default="chunking_benchmark.json")
+    args = parser.parse_args()
+
+    if args.stub_embeddings:
+        from benchmark import StubEmbeddings
+        embeddings = StubEmbeddings(latency_ms=0)
+    else:
+        from langchain_community.embeddings import OllamaEmbeddings
+        from process import OLLAMA_ENDPOINT, OLLAMA_MODEL
+        embeddings = OllamaEmbeddings(model=OLLAMA_MODEL, base_url=OLLAMA_ENDPOINT)
+
+    documents = [doc for path in iter_source_files(args.source_dir) for doc in process_file(path)]
+    questions = load_questions(args.questions)
+    results = {}
+    for profile in args.profiles:
+        results[profile] = benchmark_profile(profile, documents, questions, embeddings, args.k, args.token_budget)
+        print(profile, json.dumps(results[profile]))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
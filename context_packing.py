@@ -0,0 +1,125 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import tiktoken
+
+from dedup import ChunkDeduplicator
+from keywords import tokenize
+
+_tokenizer = None
+
+NEAR_DUPLICATE_THRESHOLD = 0.85
+MAX_PASSAGE_TOKENS = 400
+MMR_POOL_SIZE = 64  # most relevant passages considered by MMR
+
+
+def get_tokenizer():
+    # loaded on first use: the BPE file may have to be fetched and parsed
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text, disallowed_special=()))
+
+
+def dedup_texts(texts: Sequence[str], threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[str]:
+    """Drop exact (hash) and near (MinHash/LSH) duplicates, keeping first occurrences."""
+    dedup = ChunkDeduplicator(threshold=threshold)
+    return [text for i, text in enumerate(texts) if dedup.check(str(i), text) is None]
+
+
+def split_passages(text: str, max_tokens: int = MAX_PASSAGE_TOKENS) -> List[str]:
+    """Split a chunk on blank lines, then pack lines of oversized paragraphs."""
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            passages.append(paragraph)
+            continue
+        current, current_tokens = [], 0
+        for line in paragraph.splitlines():
+            line_tokens = count_tokens(line)
+            if current and current_tokens + line_tokens > max_tokens:
+                passages.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            passages.append("\n".join(current))
+    return passages
+
+
+def _norm(vec: Counter) -> float:
+    return math.sqrt(sum(v * v for v in vec.values()))
+
+
+def _cosine(a: Counter, b: Counter, norm_a: float, norm_b: float) -> float:
+    if not norm_a or not norm_b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(t, 0) for t, v in a.items()) / (norm_a * norm_b)
+
+
+def pack_context(query: str, texts: Sequence[str], token_budget: int,
+                 mmr_lambda: float = 0.7) -> Tuple[List[str], Dict]:
+    """Select relevant, non-redundant passages from retrieved chunks within a token budget.
+
+    Passages are chosen by maximal marginal relevance over term-frequency
+    vectors, so no extra embedding calls are made on the request path. Only
+    the ``MMR_POOL_SIZE`` most relevant passages are deduplicated and ranked,
+    and each candidate's redundancy is updated against the newly selected
+    passage only, so a round costs one cosine per candidate.
+    """
+    original_tokens = sum(count_tokens(text) for text in texts)
+    query_vec = Counter(tokenize(query))
+    query_norm = _norm(query_vec)
+    scored = []
+    for passage in (p for text in dedup_texts(texts) for p in split_passages(text)):
+        vec = Counter(tokenize(passage))
+        norm = _norm(vec)
+        scored.append((passage, vec, norm, _cosine(query_vec, vec, query_norm, norm)))
+    # stable sort: ties keep retrieval order
+    scored.sort(key=lambda item: item[3], reverse=True)
+    pool = scored[:MMR_POOL_SIZE]
+    dedup = ChunkDeduplicator(threshold=NEAR_DUPLICATE_THRESHOLD)
+    candidates = [(passage, vec, norm, relevance, count_tokens(passage))
+                  for i, (passage, vec, norm, relevance) in enumerate(pool)
+                  if dedup.check(str(i), passage) is None]
+    redundancy = [0.0] * len(candidates)
+    active = list(range(len(candidates)))
+
+    selected, used = [], 0
+    while active:
+        best, best_score = None, None
+        for i in active:
+            if used + candidates[i][4] > token_budget:
+                continue
+            score = mmr_lambda * candidates[i][3] - (1 - mmr_lambda) * redundancy[i]
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        passage, vec, norm, relevance, tokens = candidates[best]
+        if relevance == 0 and selected:
+            break
+        active.remove(best)
+        selected.append(passage)
+        used += tokens
+        for i in active:
+            redundancy[i] = max(redundancy[i], _cosine(candidates[i][1], vec, candidates[i][2], norm))
+
+    stats = {
+        "original_tokens": original_tokens,
+        "packed_tokens": used,
+        "saved_tokens": max(original_tokens - used, 0),
+        "token_budget": token_budget,
+    }
+    return selected, stats
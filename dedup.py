@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from keywords import tokenize
+
+DEDUP_FILENAME = "dedup_index.json"
+DEDUP_COPIES_FILENAME = "dedup_copies.json"  # canonical id -> metadata of its dropped copies
+COPY_METADATA = ("company", "file_type", "date")
+
+
+class ChunkDeduplicator:
+    """Drops exact (content hash) and near (MinHash/LSH) duplicate chunks at index time.
+
+    Canonical chunks keep their MinHash signature in LSH buckets; every
+    dropped chunk is kept as a pointer to its canonical copy together with
+    its own source, file type and date, so no provenance is lost. Chunks
+    are only compared within their partition (the company). The copies'
+    metadata is also saved per canonical chunk (see ``load_copies``) so
+    that filtered retrieval still finds a chunk whose copy matches.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, bands: int = 16,
+                 shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # multiply-shift hashing mod 2**32; odd multipliers make each one a permutation
+        self.a = (rng.randint(0, 2 ** 31, size=(num_perm, 1), dtype=np.uint64) * 2 + 1)
+        self.b = rng.randint(0, 2 ** 32, size=(num_perm, 1), dtype=np.uint64)
+        self.signatures = {}  # canonical chunk id -> signature
+        self.partitions = {}  # canonical chunk id -> partition
+        self.exact = {}       # content hash -> canonical chunk id
+        self.digests = {}     # canonical chunk id -> content hash
+        self.dropped = {}     # canonical chunk id -> set of dropped chunk ids
+        self.buckets = {}     # band key -> set of canonical chunk ids
+        self.pointers = {}    # dropped chunk id -> {"canonical", "source", "kind", "chars", *COPY_METADATA}
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha1(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+
+    def signature(self, text: str) -> np.ndarray:
+        words = tokenize(text)
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+            dtype=np.uint64,
+        )
+        return ((self.a * hashes + self.b) & np.uint64(0xFFFFFFFF)).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray, partition: str) -> List[str]:
+        return [
+            f"{partition}\0{band}:{hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).hexdigest()}"
+            for band in range(self.bands)
+        ]
+
+    def _add_canonical(self, chunk_id: str, digest: str, signature: np.ndarray, partition: str):
+        self.signatures[chunk_id] = signature
+        self.partitions[chunk_id] = partition
+        if digest:
+            self.exact[digest] = chunk_id
+            self.digests[chunk_id] = digest
+        for key in self._band_keys(signature, partition):
+            self.buckets.setdefault(key, set()).add(chunk_id)
+
+    def check(self, chunk_id: str, text: str, source: str = "", partition: str = "",
+              metadata: Optional[Dict] = None) -> Optional[str]:
+        """Register a chunk; return its canonical id if it is a duplicate, else None.
+
+        ``metadata`` is the chunk's filterable metadata, kept with the
+        pointer when the chunk is dropped.
+        """
+        digest = f"{partition}\0{self.content_hash(text)}"
+        copy = {key: (metadata or {}).get(key) for key in COPY_METADATA}
+        canonical = self.exact.get(digest)
+        if canonical is not None and canonical != chunk_id:
+            self._add_pointer(chunk_id, {"canonical": canonical, "source": source, "kind": "exact",
+                                         "chars": len(text), **copy})
+            return canonical
+
+        signature = self.signature(text)
+        candidates = set()
+        for key in self._band_keys(signature, partition):
+            candidates |= self.buckets.get(key, set())
+        candidates.discard(chunk_id)
+        best, best_score = None, 0.0
+        for candidate in candidates:
+            score = float(np.mean(self.signatures[candidate] == signature))
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is not None and best_score >= self.threshold:
+            self._add_pointer(chunk_id, {"canonical": best, "source": source, "kind": "near",
+                                         "chars": len(text), **copy})
+            return best
+
+        self._add_canonical(chunk_id, digest, signature, partition)
+        return None
+
+    def _add_pointer(self, chunk_id: str, pointer: Dict):
+        self.pointers[chunk_id] = pointer
+        self.dropped.setdefault(pointer["canonical"], set()).add(chunk_id)
+
+    def remove(self, chunk_id: str) -> List[str]:
+        """Forget a chunk; return the dropped chunks that pointed at it and are now orphaned."""
+        pointer = self.pointers.pop(chunk_id, None)
+        if pointer is not None:
+            copies = self.dropped.get(pointer["canonical"])
+            if copies is not None:
+                copies.discard(chunk_id)
+                if not copies:
+                    del self.dropped[pointer["canonical"]]
+            return []
+        signature = self.signatures.pop(chunk_id, None)
+        if signature is None:
+            return []
+        for key in self._band_keys(signature, self.partitions.pop(chunk_id)):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(chunk_id)
+                if not bucket:
+                    del self.buckets[key]
+        digest = self.digests.pop(chunk_id, None)
+        if digest is not None and self.exact.get(digest) == chunk_id:
+            del self.exact[digest]
+        orphans = list(self.dropped.pop(chunk_id, ()))
+        for dropped in orphans:
+            del self.pointers[dropped]
+        return orphans
+
+    def report(self, top: int = 10) -> Dict:
+        """Index-size summary: what was dropped and which chunks are copied most."""
+        exact = sum(1 for p in self.pointers.values() if p["kind"] == "exact")
+        copies = Counter(p["canonical"] for p in self.pointers.values())
+        return {
+            "canonical_chunks": len(self.signatures),
+            "dropped_exact": exact,
+            "dropped_near": len(self.pointers) - exact,
+            "dropped_chars": sum(p["chars"] for p in self.pointers.values()),
+            "most_copied": copies.most_common(top),
+        }
+
+    def save(self, db_dir: str):
+        path = os.path.join(db_dir, DEDUP_FILENAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "threshold": self.threshold,
+                "signatures": {cid: sig.tolist() for cid, sig in self.signatures.items()},
+                "partitions": self.partitions,
+                "exact": self.exact,
+                "pointers": self.pointers,
+            }, f)
+        os.replace(path + ".tmp", path)
+        copies = {}
+        for pointer in self.pointers.values():
+            copy = {key: pointer.get(key) for key in COPY_METADATA}
+            variants = copies.setdefault(pointer["canonical"], [])
+            if copy not in variants:
+                variants.append(copy)
+        path = os.path.join(db_dir, DEDUP_COPIES_FILENAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(copies, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, db_dir: str, **kwargs) -> "ChunkDeduplicator":
+        dedup = cls(**kwargs)
+        try:
+            with open(os.path.join(db_dir, DEDUP_FILENAME), encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return dedup
+        by_id = {cid: digest for digest, cid in data["exact"].items()}
+        partitions = data.get("partitions", {})
+        for chunk_id, signature in data["signatures"].items():
+            dedup._add_canonical(chunk_id, by_id.get(chunk_id, ""), np.array(signature, dtype=np.uint64),
+                                 partitions.get(chunk_id, ""))
+        for chunk_id, pointer in data["pointers"].items():
+            dedup._add_pointer(chunk_id, pointer)
+        return dedup
+
+
+def load_copies(db_dir: str) -> Dict[str, List[Dict]]:
+    """Canonical chunk id -> distinct metadata of the copies dropped in its favour."""
+    try:
+        with open(os.path.join(db_dir, DEDUP_COPIES_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class MicroBatcher:
+    """Collects concurrent embed_query calls into one embed_documents call.
+
+    The first request opens a window of ``window_ms``; everything that
+    arrives before it closes (up to ``max_batch``) is sent together.
+    """
+
+    def __init__(self, embeddings: Embeddings, window_ms: float = 5, max_batch: int = 32):
+        self.embeddings = embeddings
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self.queue.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embedded = self.embeddings.embed_documents(texts)
+                if len(embedded) != len(texts):
+                    raise ValueError(f"Embedding model returned {len(embedded)} vectors for {len(texts)} texts")
+                vectors = dict(zip(texts, embedded))
+            except Exception as e:
+                # every waiter gets the error; the loop itself must keep running
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+
+class CachedEmbeddings(Embeddings):
+    """LRU memo keyed by (model, text) in front of an embedding model.
+
+    Query misses go through a MicroBatcher so concurrent requests share
+    one round-trip to the embedding server.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = 10000,
+                 batch_window_ms: float = 5, max_batch: int = 32):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.batcher = MicroBatcher(embeddings, batch_window_ms, max_batch) if batch_window_ms else None
+
+    def _get(self, text: str):
+        key = (self.model_name, text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+            return vector
+
+    def _put(self, text: str, vector: List[float]):
+        key = (self.model_name, text)
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            if self.batcher:
+                vector = self.batcher.submit(text).result()
+            else:
+                vector = self.embeddings.embed_query(text)
+            self._put(text, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [self._get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            fresh = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            for text, vector in fresh.items():
+                self._put(text, vector)
+            vectors = [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+        return vectors
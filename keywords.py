@@ -0,0 +1,100 @@
+import json
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+VOCAB_FILENAME = "keyword_vocab.json"
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MIN_TERM_LENGTH = 3
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if len(t) >= MIN_TERM_LENGTH]
+
+
+def fallback_keywords(question: str) -> List[str]:
+    return re.findall(r'\b\w{4,}\b', question.lower())[:3]
+
+
+def build_vocabulary(texts: Iterable[str]) -> Dict:
+    """Document frequency of every term over the indexed chunks."""
+    df = Counter()
+    num_docs = 0
+    for text in texts:
+        num_docs += 1
+        df.update(set(tokenize(text)))
+    return {"num_docs": num_docs, "df": dict(df)}
+
+
+def save_vocabulary(vocab: Dict, db_dir: str):
+    path = os.path.join(db_dir, VOCAB_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_vocabulary(db_dir: str) -> Optional[Dict]:
+    path = os.path.join(db_dir, VOCAB_FILENAME)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading keyword vocabulary {path}: {e}")
+        return None
+
+
+class KeywordExtractor:
+    """Ranks question terms by IDF over the indexed corpus.
+
+    Terms that never occur in the corpus cannot help retrieval and terms
+    occurring in almost every chunk carry no signal, so both are skipped.
+    """
+
+    def __init__(self, vocab: Optional[Dict] = None, max_keywords: int = 5, max_df_ratio: float = 0.5):
+        self.max_keywords = max_keywords
+        self.idf = {}
+        if vocab and vocab.get("num_docs"):
+            num_docs = vocab["num_docs"]
+            max_df = max(1, int(num_docs * max_df_ratio))
+            self.idf = {
+                term: math.log((num_docs + 1) / (df + 1)) + 1
+                for term, df in vocab["df"].items()
+                if df <= max_df
+            }
+
+    @classmethod
+    def from_db_dir(cls, db_dir: str, **kwargs) -> "KeywordExtractor":
+        return cls(load_vocabulary(db_dir), **kwargs)
+
+    def __bool__(self):
+        return bool(self.idf)
+
+    def extract(self, question: str) -> List[str]:
+        tf = Counter(t for t in tokenize(question) if t in self.idf)
+        ranked = sorted(tf, key=lambda t: tf[t] * self.idf[t], reverse=True)
+        return ranked[:self.max_keywords]
+
+
+class KeywordMemo:
+    """Small LRU memo of question -> keywords, shared by every extraction mode."""
+
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, question: str) -> Optional[List[str]]:
+        keywords = self.entries.get(question)
+        if keywords is not None:
+            self.entries.move_to_end(question)
+        return keywords
+
+    def put(self, question: str, keywords: List[str]):
+        self.entries[question] = keywords
+        self.entries.move_to_end(question)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,263 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+
+class LLMBackend:
+    """One LLM client plus a rolling window of its latencies and failures."""
+
+    def __init__(self, name: str, client, timeout: float = 60, window: int = 100):
+        self.name = name
+        self.client = client
+        self.timeout = timeout
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool):
+        with self.lock:
+            if ok:
+                self.latencies.append(seconds)
+            self.outcomes.append(ok)
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self.lock:
+            if not self.latencies:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def invoke(self, prompt: str) -> str:
+        response = self.client.invoke(prompt)
+        # ChatOpenAI returns a message object, OllamaLLM a plain string
+        return getattr(response, "content", response)
+
+    def stream(self, prompt: str):
+        for chunk in self.client.stream(prompt):
+            yield getattr(chunk, "content", chunk)
+
+
+class LLMRouter:
+    """Routes each call to the backend with the best rolling latency/error score.
+
+    Every call has a deadline (the backend's ``timeout``). With hedging on,
+    a second request goes to the next backend once the primary has been
+    running longer than its ``hedge_percentile`` latency, and whichever
+    answers first wins. A failed or timed-out primary falls back to the
+    next backend.
+
+    Blocking client calls run on the router's own pool of
+    ``max_concurrency`` threads, and a slot is only released when the
+    thread returns. A call abandoned at its deadline therefore still counts
+    against the limit and cannot pile up in the shared threadpool; the
+    clients' own HTTP timeouts bound how long it lingers. Hedges have their
+    own ``hedge_slots``: a hedge queued behind primaries under load would
+    come too late, so it is skipped when none is free.
+    """
+
+    def __init__(self, backends: List[LLMBackend], hedge: bool = False, hedge_percentile: float = 0.95,
+                 min_samples: int = 10, route_counter=None, latency_histogram=None, max_concurrency: int = 4,
+                 hedge_slots: int = 1):
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.route_counter = route_counter
+        self.latency_histogram = latency_histogram
+        self.max_concurrency = max_concurrency
+        self.hedge_slots = hedge_slots
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency + hedge_slots, thread_name_prefix="llm")
+        self._slots = None        # asyncio.Semaphores, created on the serving loop
+        self._hedge_slots = None
+
+    def _score(self, backend: LLMBackend) -> float:
+        p50 = backend.percentile(0.5)
+        if p50 is None or len(backend.latencies) < self.min_samples:
+            # unmeasured backends keep their configured order
+            p50 = backend.timeout / 4
+        return p50 * (1 + 4 * backend.error_rate())
+
+    def ranked(self) -> List[LLMBackend]:
+        order = {id(backend): i for i, backend in enumerate(self.backends)}
+        return sorted(self.backends, key=lambda b: (self._score(b), order[id(b)]))
+
+    def _count(self, backend: LLMBackend, outcome: str):
+        if self.route_counter is not None:
+            self.route_counter.inc(backend=backend.name, outcome=outcome)
+
+    def _slot_pool(self, hedge: bool = False) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._hedge_slots = asyncio.Semaphore(self.hedge_slots)
+        return self._hedge_slots if hedge else self._slots
+
+    def _start(self, slots: asyncio.Semaphore, fn, *args) -> asyncio.Future:
+        """Run ``fn`` on the router's pool in a slot already taken from ``slots``; it is freed when ``fn`` returns."""
+        loop = asyncio.get_running_loop()
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(slots.release)
+            except RuntimeError:
+                pass  # the loop closed while an abandoned call was still running
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(release)
+        return asyncio.wrap_future(future)
+
+    async def _submit(self, fn, *args) -> asyncio.Future:
+        slots = self._slot_pool()
+        await slots.acquire()
+        return self._start(slots, fn, *args)
+
+    async def _run(self, backend: LLMBackend, prompt: str) -> str:
+        return await self._finish(backend, await self._submit(backend.invoke, prompt))
+
+    async def _finish(self, backend: LLMBackend, future: asyncio.Future) -> str:
+        start = time.perf_counter()
+        try:
+            text = await asyncio.wait_for(future, backend.timeout)
+        except asyncio.TimeoutError:
+            backend.record(time.perf_counter() - start, False)
+            self._count(backend, "timeout")
+            raise
+        except Exception:
+            backend.record(time.perf_counter() - start, False)
+            self._count(backend, "error")
+            raise
+        elapsed = time.perf_counter() - start
+        backend.record(elapsed, True)
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(elapsed, backend=backend.name)
+        return text
+
+    async def ainvoke(self, prompt: str) -> str:
+        ranked = self.ranked()
+        primary, fallbacks = ranked[0], ranked[1:]
+        primary_task = asyncio.ensure_future(self._run(primary, prompt))
+
+        hedge_after = primary.percentile(self.hedge_percentile) if self.hedge and fallbacks else None
+        if hedge_after is not None and len(primary.latencies) >= self.min_samples:
+            done, _ = await asyncio.wait({primary_task}, timeout=hedge_after)
+            if not done:
+                hedge = fallbacks[0]
+                hedge_slots = self._slot_pool(hedge=True)
+                if hedge_slots.locked():
+                    self._count(hedge, "hedge_skipped")
+                else:
+                    # a free slot is taken without waiting, and the call starts
+                    # before any other request can see the slot as free
+                    await hedge_slots.acquire()
+                    self._count(hedge, "hedge")
+                    hedge_task = asyncio.ensure_future(
+                        self._finish(hedge, self._start(hedge_slots, hedge.invoke, prompt)))
+                    return await self._first_success({primary_task: primary, hedge_task: hedge},
+                                                     prompt, fallbacks[1:])
+
+        try:
+            text = await primary_task
+            self._count(primary, "primary")
+            return text
+        except Exception:
+            if not fallbacks:
+                raise
+        return await self._fallback(prompt, fallbacks)
+
+    async def _first_success(self, tasks: dict, prompt: str, fallbacks: List[LLMBackend]) -> str:
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self._count(tasks[task], "won")
+                    return task.result()
+                error = task.exception()
+        if fallbacks:
+            return await self._fallback(prompt, fallbacks)
+        raise error
+
+    async def _stream_one(self, backend: LLMBackend, prompt: str, emitted: list) -> AsyncIterator[str]:
+        """Stream from one backend; every chunk, including the first, must arrive within ``timeout``."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for text in backend.stream(prompt):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        await self._submit(produce)
+        start = time.perf_counter()
+        ok = False
+        try:
+            while True:
+                item = await asyncio.wait_for(queue.get(), backend.timeout)
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if item:
+                    emitted.append(item)
+                    yield item
+            ok = True
+        except asyncio.TimeoutError:
+            self._count(backend, "timeout")
+            raise
+        except GeneratorExit:
+            ok = None  # the client went away; says nothing about the backend
+            raise
+        finally:
+            # a hung producer keeps its slot until the client's own timeout fires
+            stop.set()
+            if ok is not None:
+                backend.record(time.perf_counter() - start, ok)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream from the best backend, falling back while nothing has been sent yet."""
+        error = None
+        for backend in self.ranked():
+            emitted = []
+            try:
+                async for text in self._stream_one(backend, prompt, emitted):
+                    yield text
+                self._count(backend, "stream")
+                return
+            except Exception as e:
+                if emitted:
+                    # tokens already reached the client; a restart would duplicate them
+                    raise
+                if not isinstance(e, asyncio.TimeoutError):
+                    self._count(backend, "error")
+                error = e
+        raise error
+
+    async def _fallback(self, prompt: str, fallbacks: List[LLMBackend]) -> str:
+        error = None
+        for backend in fallbacks:
+            try:
+                text = await self._run(backend, prompt)
+                self._count(backend, "fallback")
+                return text
+            except Exception as e:
+                error = e
+        raise error
@@ -1,164 +1,457 @@
 import os
+import re
 import time
+import json
+import hashlib
 import requests
 import zipfile
 import pandas as pd
 import magic
+import fitz  # PyMuPDF
+import openpyxl
 import xml.etree.ElementTree as ET
-from typing import List, Optional
+from datetime import date
+from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from langchain.schema import Document
 from langchain_community.document_loaders import (
     TextLoader,
-    CSVLoader,
-    UnstructuredExcelLoader
+    CSVLoader
 )
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
+from keywords import save_vocabulary
+from retrieval import BM25Index
+from bulk_embedder import BulkEmbedder
+from chunking import PROFILES, make_splitter
+from dedup import DEDUP_FILENAME, ChunkDeduplicator
+from vector_index import MMAP_DIRNAME, MmapVectorIndex
 
 KAP_DIR = "/home/ali/kap_downloads"
 DB_DIR = "/home/ali/rag_db_r1"
-CHUNK_SIZE = 30000
-CHUNK_OVERLAP = 50
+CHUNK_PROFILE = os.getenv("CHUNK_PROFILE", "legacy")  # see chunking.PROFILES
+INDEX_META_FILENAME = "index_meta.json"
+METADATA_VERSION = 3  # bump when the metadata tagged onto chunks changes
+FILENAME_DATE_PATTERN = re.compile(r"(20\d{2})[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])")
 OLLAMA_MODEL = "all-minilm"
 OLLAMA_ENDPOINT = "http://localhost:11434"
-def convert_pdf_to_txt(pdf_path: str) -> Optional[str]:
-    txt_path = os.path.splitext(pdf_path)[0] + ".txt"
-    try:
-        os.system(f"pdftotext '{pdf_path}' '{txt_path}'")
-        return txt_path if os.path.exists(txt_path) else None
-    except Exception as e:
-        print(f"Error converting PDF to text: {e}")
-        return None
+MANIFEST_FILENAME = "ingest_manifest.json"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", str(2 * INGEST_WORKERS)))  # files parsed ahead
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))  # chunks per vector DB upsert
+CHECKPOINT_BATCHES = int(os.getenv("CHECKPOINT_BATCHES", "10"))  # upserts between checkpoints
+EMBED_REQUEST_SIZE = int(os.getenv("EMBED_REQUEST_SIZE", "32"))  # texts per Ollama request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # Ollama requests in flight
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "5"))
+EMBED_CACHE_FILENAME = "embedding_cache.sqlite"
+EXCEL_ROWS_PER_BLOCK = 500
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "mmap" also exports a memory-mapped index
+MMAP_DTYPE = os.getenv("MMAP_DTYPE", "float16")  # "float16" or "int8"
+MMAP_NLIST = int(os.getenv("MMAP_NLIST", "0"))  # IVF lists; 0 = exact scan, ~sqrt(chunks) for large corpora
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))  # MinHash Jaccard; 0 disables dedup
 
-def convert_xml_to_txt(xml_path: str) -> Optional[str]:
-    txt_path = os.path.splitext(xml_path)[0] + ".txt"
-    try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        with open(txt_path, 'w') as f:
-            for elem in root.iter():
-                if elem.text and elem.text.strip():
-                    f.write(elem.text.strip() + "\n")
-        return txt_path
-    except Exception as e:
-        print(f"Error converting XML to text: {e}")
-        return None
+# extraction errors propagate: parse_file_worker reports the file as failed
+# so it stays out of the manifest and is retried on the next run
+
+def extract_pdf_text(pdf_path: str) -> str:
+    with fitz.open(pdf_path) as doc:
+        pages = [page.get_text("text") for page in doc]
+    return "\n\n".join(pages)
+
+def extract_xml_text(xml_path: str) -> str:
+    """Stream the XML with iterparse, clearing elements once their text is taken.
+
+    Each element reserves its line on ``start`` and fills it on ``end`` (when
+    its text is complete), so a parent's text such as a section title stays
+    before its children's. A blank line after each top-level element keeps
+    XML sections together as one block for the structure-aware splitters.
+    """
+    lines, slots = [], []
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            slots.append(len(lines))
+            lines.append(None)
+            continue
+        slot = slots.pop()
+        if elem.text and elem.text.strip():
+            lines[slot] = elem.text.strip()
+        if len(slots) == 1:
+            lines.append("")
+        if slots:
+            elem.clear()
+    return "\n".join(line for line in lines if line is not None)
+
+def iter_excel_lines(file_path: str):
+    """Yield one line per sheet heading and tab-separated row, reading rows in a stream."""
+    if file_path.lower().endswith(".xlsx"):
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                yield f"# {sheet.title}"
+                for row in sheet.iter_rows(values_only=True):
+                    if any(cell is not None for cell in row):
+                        yield "\t".join("" if cell is None else str(cell) for cell in row)
+                yield ""
+        finally:
+            workbook.close()
+        return
+    # legacy .xls has no streaming reader; pandas loads one sheet at a time
+    with pd.ExcelFile(file_path) as workbook:
+        for sheet_name in workbook.sheet_names:
+            yield from _iter_sheet_lines(sheet_name, workbook.parse(sheet_name))
+
+def _iter_sheet_lines(sheet_name: str, df):
+    yield f"# {sheet_name}"
+    yield "\t".join(str(col) for col in df.columns)
+    for row in df.itertuples(index=False):
+        yield "\t".join("" if pd.isna(cell) else str(cell) for cell in row)
+    yield ""
+
+def extract_excel_text(file_path: str) -> str:
+    blocks, rows = [], []
+    for line in iter_excel_lines(file_path):
+        rows.append(line)
+        # a blank line every EXCEL_ROWS_PER_BLOCK rows lets huge sheets split on row boundaries
+        if len(rows) >= EXCEL_ROWS_PER_BLOCK:
+            blocks.append("\n".join(rows))
+            rows = []
+    if rows:
+        blocks.append("\n".join(rows))
+    return "\n\n".join(blocks)
 
 def load_text_file(file_path: str) -> List[Document]:
-    try:
-        loader = TextLoader(file_path)
-        return loader.load()
-    except Exception as e:
-        print(f"Error loading text file {file_path}: {e}")
-        return []
+    return TextLoader(file_path).load()
+
+def file_metadata(file_path: str) -> dict:
+    """Filterable metadata for every chunk of a file.
+
+    ``company`` is the top-level directory under KAP_DIR, ``date`` the
+    YYYYMMDD integer found in the file name, or the modification date.
+    """
+    relative = os.path.relpath(file_path, KAP_DIR)
+    company = relative.split(os.sep, 1)[0] if os.sep in relative and not relative.startswith("..") else ""
+    match = FILENAME_DATE_PATTERN.search(os.path.basename(file_path))
+    if match:
+        file_date = int("".join(match.groups()))
+    else:
+        file_date = int(date.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y%m%d"))
+    return {
+        "source": file_path,
+        "company": company,
+        "file_type": os.path.splitext(file_path)[1].lower().lstrip("."),
+        "date": file_date,
+    }
 
 def process_file(file_path: str) -> List[Document]:
+    """Extract one file into Documents in memory; the source tree is never written to."""
+    docs = extract_file(file_path)
+    metadata = file_metadata(file_path)
+    for doc in docs:
+        doc.metadata.update(metadata)
+    return docs
+
+def extract_file(file_path: str) -> List[Document]:
     ext = os.path.splitext(file_path)[1].lower()
     
     if ext == '.txt':
         return load_text_file(file_path)
     
-    elif ext == '.pdf':
-        txt_path = convert_pdf_to_txt(file_path)
-        if txt_path:
-            return load_text_file(txt_path)
-    
+    if ext == '.pdf':
+        text = extract_pdf_text(file_path)
     elif ext == '.xml':
-        txt_path = convert_xml_to_txt(file_path)
-        if txt_path:
-            return load_text_file(txt_path)
-    
+        text = extract_xml_text(file_path)
     elif ext in ('.xls', '.xlsx'):
-        try:
-            loader = UnstructuredExcelLoader(file_path, mode="elements")
-            docs = loader.load()
-            if docs:
-                return docs
-            
-            df = pd.read_excel(file_path, engine=None)
-            txt_path = os.path.splitext(file_path)[0] + ".txt"
-            df.to_csv(txt_path, sep='\t', index=False)
-            return load_text_file(txt_path)
-        except Exception as e:
-            print(f"Error processing Excel file {file_path}: {e}")
-    
-    return []
+        text = extract_excel_text(file_path)
+    else:
+        return []
 
-def process_directory(directory: str) -> List[Document]:
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP
-    )
-    
-    all_docs = []
-    
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.startswith('.'):
-                continue
-                
-            file_path = os.path.join(root, file)
-            try:
-                docs = process_file(file_path)
-                if docs:
-                    all_docs.extend(docs)
-                    print(f"Processed: {file_path}")
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-                continue
-    
-    if not all_docs:
+    if not text or not text.strip():
         return []
-    
+    return [Document(page_content=text, metadata={"source": file_path})]
+
+def make_chunk_ids(documents: List[Document]) -> List[str]:
+    """Stable ids shared by the vector DB and the BM25 index."""
+    ids = []
+    seen = {}
+    for doc in documents:
+        key = f"{doc.metadata.get('source', '')}\0{doc.page_content}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        seen[digest] = seen.get(digest, 0) + 1
+        ids.append(digest if seen[digest] == 1 else f"{digest}-{seen[digest]}")
+    return ids
+
+def iter_source_files(directory: str):
+    for root, _, files in os.walk(directory):
+        for file in sorted(files):
+            if not file.startswith('.'):
+                yield os.path.join(root, file)
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest() -> dict:
     try:
-        return text_splitter.split_documents(all_docs)
-    except Exception as e:
-        print(f"Error splitting documents: {e}")
-        return []
+        with open(os.path.join(DB_DIR, MANIFEST_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
 
-def create_vector_db(documents: List[Document]) -> bool:
-    if not documents:
-        print("No valid documents to process")
-        return False
-    print(f"\nCreating vector database with {len(documents)} chunks...")
+def load_index_meta() -> dict:
     try:
-        embeddings = OllamaEmbeddings(
-            model=OLLAMA_MODEL,
-            base_url=OLLAMA_ENDPOINT
-        )
-        db = Chroma.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            persist_directory=DB_DIR
-        )
-        db.persist()
-        print(f"Database successfully created at {DB_DIR}")
-        return True
+        with open(os.path.join(DB_DIR, INDEX_META_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_index_meta():
+    path = os.path.join(DB_DIR, INDEX_META_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"chunk_profile": CHUNK_PROFILE, "metadata_version": METADATA_VERSION,
+                   **PROFILES[CHUNK_PROFILE]}, f)
+    os.replace(path + ".tmp", path)
+
+def save_manifest(manifest: dict):
+    path = os.path.join(DB_DIR, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def split_file(file_path: str, text_splitter) -> List[Document]:
+    docs = process_file(file_path)
+    return text_splitter.split_documents(docs) if docs else []
+
+def parse_file_worker(file_path: str):
+    """Pool task: extract and split one file, returning (path, chunks, error)."""
+    text_splitter = make_splitter(CHUNK_PROFILE)
+    try:
+        return file_path, split_file(file_path, text_splitter), None
     except Exception as e:
-        print(f"Error creating database: {e}")
-        return False
+        return file_path, [], str(e)
+
+def parse_files(paths: List[str], workers: int = INGEST_WORKERS, queue_size: int = INGEST_QUEUE_SIZE):
+    """Parse files on a process pool.
+
+    At most ``queue_size`` files are in flight or waiting to be consumed, so
+    parsed chunks never pile up faster than they are embedded. Results come
+    back in the order of ``paths`` whatever order the workers finish in, so
+    chunk ids and insertion order are deterministic.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        yield from map(parse_file_worker, paths)
+        return
+    remaining = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque(executor.submit(parse_file_worker, path)
+                       for _, path in zip(range(max(queue_size, workers)), remaining))
+        while window:
+            result = window.popleft().result()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                window.append(executor.submit(parse_file_worker, next_path))
+            yield result
+
+def scan_changes(manifest: dict, paths: List[str]):
+    """Compare the tree with the manifest.
+
+    Size and mtime are checked first; the content hash is only computed
+    when they differ, so untouched files cost one stat call.
+    Returns (changed paths with their new manifest entries, removed paths).
+    """
+    changed = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = manifest.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        sha256 = file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            entry["mtime"] = stat.st_mtime
+            continue
+        changed[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256, "chunk_ids": []}
+    present = set(paths)
+    removed = [path for path in manifest if path not in present]
+    return changed, removed
+
+def iter_batches(parsed, manifest_entries: dict, failed: List[str], batch_size: int = EMBED_BATCH_SIZE):
+    """Group parsed files into upsert batches of about ``batch_size`` chunks.
+
+    Batches end on file boundaries so a committed batch always covers whole
+    files, which is what lets the manifest act as the resume checkpoint.
+    """
+    chunks, ids, entries = [], [], {}
+    for path, file_chunks, error in parsed:
+        if error:
+            print(f"Error processing {path}: {error}")
+            failed.append(path)
+            continue
+        entry = manifest_entries[path]
+        entry["chunk_ids"] = make_chunk_ids(file_chunks)
+        chunks.extend(file_chunks)
+        ids.extend(entry["chunk_ids"])
+        entries[path] = entry
+        print(f"Processed: {path} ({len(file_chunks)} chunks)")
+        if len(chunks) >= batch_size:
+            yield chunks, ids, entries
+            chunks, ids, entries = [], [], {}
+    if entries:
+        yield chunks, ids, entries
+
+class IndexWriter:
+    """Applies deletes and batched upserts to Chroma, the BM25 index and the vocabulary."""
+
+    def __init__(self):
+        self.embeddings = BulkEmbedder(
+            OllamaEmbeddings(
+                model=OLLAMA_MODEL,
+                base_url=OLLAMA_ENDPOINT
+            ),
+            cache_path=os.path.join(DB_DIR, EMBED_CACHE_FILENAME),
+            batch_size=EMBED_REQUEST_SIZE,
+            max_in_flight=EMBED_CONCURRENCY,
+            retries=EMBED_RETRIES,
+        )
+        self.db = Chroma(persist_directory=DB_DIR, embedding_function=self.embeddings)
+        self.bm25 = BM25Index.load(DB_DIR) or BM25Index()
+        self.dedup = ChunkDeduplicator.load(DB_DIR, threshold=DEDUP_THRESHOLD) if DEDUP_THRESHOLD > 0 else None
+
+    def reset(self):
+        """Empty every index; used when the chunks on disk are not tracked by a manifest."""
+        self.db.delete_collection()
+        self.db = Chroma(persist_directory=DB_DIR, embedding_function=self.embeddings)
+        self.bm25 = BM25Index()
+        if self.dedup is not None:
+            self.dedup = ChunkDeduplicator(threshold=DEDUP_THRESHOLD)
+
+    def delete(self, ids: List[str]) -> List[str]:
+        """Delete chunks; return dropped duplicates whose canonical copy went with them."""
+        orphans = []
+        if ids:
+            self.db.delete(ids=ids)
+            for chunk_id in ids:
+                self.bm25.remove(chunk_id)
+                if self.dedup is not None:
+                    orphans.extend(self.dedup.remove(chunk_id))
+        return orphans
+
+    def upsert(self, chunks: List[Document], ids: List[str]) -> int:
+        """Store the chunks that are not duplicates of indexed ones; return how many were dropped."""
+        for chunk, chunk_id in zip(chunks, ids):
+            # lets filters match a chunk by id when a deduplicated copy of it matches
+            chunk.metadata["chunk_id"] = chunk_id
+        if self.dedup is not None:
+            kept = [(chunk, chunk_id) for chunk, chunk_id in zip(chunks, ids)
+                    if self.dedup.check(chunk_id, chunk.page_content, chunk.metadata.get("source", ""),
+                                        chunk.metadata.get("company", ""), chunk.metadata) is None]
+            dropped = len(chunks) - len(kept)
+            chunks, ids = [c for c, _ in kept], [i for _, i in kept]
+        else:
+            dropped = 0
+        if chunks:
+            self.db.add_documents(chunks, ids=ids)
+            self.bm25.add_documents(ids, chunks)
+        return dropped
+
+    def checkpoint(self, manifest: dict):
+        """Persist every index, then the manifest that records what they contain."""
+        self.db.persist()
+        self.bm25.save(DB_DIR)
+        save_vocabulary(self.bm25.vocabulary(), DB_DIR)
+        if self.dedup is not None:
+            self.dedup.save(DB_DIR)
+        save_manifest(manifest)
 
 def main():
     os.makedirs(KAP_DIR, exist_ok=True)
     os.makedirs(DB_DIR, exist_ok=True)
-        
-    all_chunks = []
-    
-    if os.path.exists(KAP_DIR):
-        for company_dir in os.listdir(KAP_DIR):
-            print(company_dir)
-            full_path = os.path.join(KAP_DIR, company_dir)
-            if os.path.isdir(full_path):
-                chunks = process_directory(full_path)
-                if chunks:
-                    all_chunks.extend(chunks)
-                    print(f"Processed {len(chunks)} chunks from {company_dir}")
-    
-    if all_chunks:
-        create_vector_db(all_chunks)
-    else:
-        print("No valid documents found to process")
+
+    manifest = load_manifest()
+    index_meta = load_index_meta()
+    # indexes built before profiles existed used the legacy splitter
+    indexed_profile = index_meta.get("chunk_profile", "legacy")
+    reindex_reason = None
+    if indexed_profile != CHUNK_PROFILE:
+        # chunks from another profile cannot be mixed in: re-chunk every file
+        reindex_reason = f"Chunk profile changed ({indexed_profile} -> {CHUNK_PROFILE})"
+    elif index_meta.get("metadata_version", 0) != METADATA_VERSION:
+        # filters would silently miss chunks indexed without the current metadata
+        reindex_reason = "Chunk metadata changed"
+    if manifest and reindex_reason:
+        print(f"{reindex_reason}, re-indexing all files")
+        for entry in manifest.values():
+            entry["size"], entry["sha256"] = -1, ""
+    paths = []
+    for company_dir in sorted(os.listdir(KAP_DIR)):
+        full_path = os.path.join(KAP_DIR, company_dir)
+        if os.path.isdir(full_path):
+            paths.extend(iter_source_files(full_path))
+
+    changed, removed = scan_changes(manifest, paths)
+    try:
+        writer = IndexWriter()
+        if not manifest and writer.db.get(limit=1)["ids"]:
+            # built by the old full rebuild: random chunk ids that no manifest
+            # can delete, so start over instead of adding a second copy
+            print("Existing index has no manifest, rebuilding it from scratch")
+            writer.reset()
+        deleted_ids = []
+        stale = removed + [p for p in changed if p in manifest]
+        while stale:
+            stale_ids = []
+            for path in stale:
+                stale_ids.extend(manifest.pop(path)["chunk_ids"])
+            deleted_ids.extend(stale_ids)
+            orphans = set(writer.delete(stale_ids))
+            # files whose chunks were dropped as copies of a deleted chunk must be
+            # re-indexed, otherwise their text would vanish from the index
+            stale = [path for path, entry in manifest.items() if orphans.intersection(entry["chunk_ids"])]
+            for path in stale:
+                changed[path] = {**manifest[path], "chunk_ids": []}
+        unchanged = sum(len(entry["chunk_ids"]) for entry in manifest.values())
+        writer.checkpoint(manifest)
+        save_index_meta()
+
+        added, duplicates, failed = 0, 0, []
+        batches = iter_batches(parse_files(list(changed)), changed, failed)
+        for batch_number, (chunks, ids, entries) in enumerate(batches, 1):
+            dropped = writer.upsert(chunks, ids)
+            manifest.update(entries)
+            added += len(chunks) - dropped
+            duplicates += dropped
+            if batch_number % CHECKPOINT_BATCHES == 0:
+                writer.checkpoint(manifest)
+                print(f"Checkpoint: {added} chunks committed")
+        writer.checkpoint(manifest)
+        writer.embeddings.close()
+        mmap_path = os.path.join(DB_DIR, MMAP_DIRNAME)
+        # an emptied corpus is exported too, so deleted chunks stop being served
+        if VECTOR_BACKEND == "mmap" and (added or deleted_ids or not os.path.exists(mmap_path)):
+            MmapVectorIndex.from_chroma(writer.db, mmap_path, dtype=MMAP_DTYPE, nlist=MMAP_NLIST)
+            print(f"Memory-mapped index exported ({len(writer.bm25)} chunks, {MMAP_DTYPE}, nlist={MMAP_NLIST})")
+    except Exception as e:
+        print(f"Error updating database: {e}")
+        print("Re-run to resume from the last checkpoint.")
+        return
+
+    print(f"Database successfully updated at {DB_DIR}")
+    print(f"Files parsed: {len(changed) - len(failed)}, failed: {len(failed)}")
+    for path in failed:
+        print(f"  failed: {path}")
+    print(f"Chunks added: {added}, duplicates dropped: {duplicates}, deleted: {len(deleted_ids)}, unchanged: {unchanged}")
+    if writer.dedup is not None:
+        report = writer.dedup.report()
+        print(f"Dedup ({os.path.join(DB_DIR, DEDUP_FILENAME)}): {report['canonical_chunks']} canonical chunks, "
+              f"{report['dropped_exact']} exact and {report['dropped_near']} near duplicates dropped "
+              f"({report['dropped_chars']} characters not embedded)")
+        for chunk_id, copies in report["most_copied"]:
+            print(f"  {copies} copies of {chunk_id} ({writer.bm25.docs.get(chunk_id, {}).get('metadata', {}).get('source', '?')})")
 
 if __name__ == "__main__":
     main()
@@ -2,25 +2,47 @@ from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.llms import Ollama
 from typing import List, Tuple
-import re
 import json
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import warnings
 import os
 import subprocess
 import shutil
+from keywords import KeywordExtractor, KeywordMemo, fallback_keywords
+from retrieval import BM25Index, build_filters, hybrid_search
+from vector_index import open_mmap_index
+from dedup import load_copies
 warnings.filterwarnings("ignore")
 embedding_model = OllamaEmbeddings(model="all-minilm")
 llm = Ollama(model="mistral")
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+DB_DIR = "/home/ali/rag_db_r1"
+KEYWORD_MODE = os.getenv("KEYWORD_MODE", "llm")  # "llm" or "local"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "mmap" (built by process.py)
 #TEXT_FILE = "SUMMARY.txt"
 
-db = Chroma(persist_directory="/home/ali/rag_db_r1", embedding_function=embedding_model)
+def load_indexes():
+    """(Re)open everything process.py writes; called again after each re-index."""
+    global db, keyword_extractor, keyword_memo, bm25_index, dedup_copies
+    db = open_mmap_index(DB_DIR, embedding_model) if VECTOR_BACKEND == "mmap" else None
+    if db is None:
+        db = Chroma(persist_directory=DB_DIR, embedding_function=embedding_model)
+    keyword_extractor = KeywordExtractor.from_db_dir(DB_DIR)
+    keyword_memo = KeywordMemo()  # local keywords depend on the vocabulary
+    bm25_index = BM25Index.load(DB_DIR)
+    dedup_copies = load_copies(DB_DIR)
+
+load_indexes()
 
 def generate_keywords_and_prompt(user_question: str) -> Tuple[str, List[str]]:
     """with open(TEXT_FILE, "r", encoding="utf-8") as file:
         summary = file.read()    """
+    keywords = keyword_memo.get(user_question)
+    if keywords is not None:
+        return keywords
+    if KEYWORD_MODE == "local" and keyword_extractor:
+        keywords = keyword_extractor.extract(user_question) or fallback_keywords(user_question)
+        keyword_memo.put(user_question, keywords)
+        return keywords
+
     prompt = f"""Analyze this API documentation summary and the user question:
 
     Perform these tasks:
@@ -40,13 +62,25 @@ def generate_keywords_and_prompt(user_question: str) -> Tuple[str, List[str]]:
         json_end = response.rfind('}') + 1
         json_str = response[json_start:json_end]
         data = json.loads(json_str)
-        return data["keywords"]
+        keywords = data["keywords"]
     except:
-        keywords = re.findall(r'\b\w{4,}\b', user_question.lower())
-        return keywords[:3]
+        keywords = fallback_keywords(user_question)
+    keyword_memo.put(user_question, keywords)
+    return keywords
 
-def promptt(question: str, optimized_prompt: str, keywords: List[str], k=5) -> str:
-    docs = db.similarity_search(keywords, k=k)
+def parse_filter_command(text: str):
+    """``company=X type=pdf since=2024-01-01 until=2024-12-31``; empty clears the filter."""
+    fields = {"company": "company", "type": "file_type", "since": "date_from", "until": "date_to"}
+    args = {}
+    for part in text.split():
+        name, _, value = part.partition("=")
+        if name not in fields or not value:
+            raise ValueError(f"Unknown filter {part!r}, use {', '.join(f + '=' for f in fields)}")
+        args[fields[name]] = value
+    return build_filters(**args)
+
+def promptt(question: str, optimized_prompt: str, keywords: List[str], k=5, filters=None) -> str:
+    docs = hybrid_search(db, bm25_index, " ".join(keywords), k=k, filters=filters, copies=dedup_copies)
     
     context = "\n\n".join([doc.page_content for doc in docs])
     print(f"\n[DEBUG] Using keywords: {keywords}")
@@ -67,9 +101,14 @@ def promptt(question: str, optimized_prompt: str, keywords: List[str], k=5) -> s
     response = llm(prompt)
     return response
 
+filters = None
 while True:
     try:
         q = input("\nQuestion: ").strip()
+        if q.startswith("FILTER:"):
+            filters = parse_filter_command(q.split("FILTER:", 1)[1])
+            print(f"Filter: {filters or 'none'}")
+            continue
         if q.startswith("NEWPROJECT:"):
             PROJECT_DIR = q.split("NEWPROJECT:")[1].strip()
             if not os.path.isdir(PROJECT_DIR):
@@ -81,14 +120,16 @@ while True:
             shutil.copy(f"{PROJECT_DIR}/DOCGEN_DOCUMENT.md", "/home/ali/kap_downloads/kfs/deneme.txt")
             shutil.copy(f"{PROJECT_DIR}/DOCGEN_DOCUMENT.md", "/home/ali/projects/rag_api/readme.txt")
             subprocess.run(["python", "process.py"])
+            load_indexes()
         elif q.startswith("NEWDOCS:"):
             #subprocess.run(["python", "docs.py"]) for summary
             subprocess.run(["python", "process.py"])
+            load_indexes()
             continue
         if q.lower() == 'exit':
             break
         keywords = generate_keywords_and_prompt(q)
-        answer = promptt(q, q, keywords)
+        answer = promptt(q, q, keywords, filters=filters)
         print(f"\nAnswer: {answer}")
     except Exception as e:
         print(f"\nError: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+
+class PromptLogger:
+    """JSON-lines request log written by a background thread.
+
+    ``log`` never blocks the caller: when the queue is full (slow disk) the
+    record is dropped and counted in ``dropped``. Full prompt bodies are only
+    kept for a ``sample_rate`` fraction of records; every record carries the
+    prompt hash.
+
+    A ``{pid}`` in ``path`` is replaced by the process id. Each worker then
+    rotates only its own file; workers sharing one RotatingFileHandler path
+    would rename the file under each other and overwrite the backups.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 queue_size: int = 1000, sample_rate: float = 0.1):
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self._thread = threading.Thread(target=self._writer, name="prompt-logger", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def prompt_hash(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+    def log(self, record: dict, prompt: Optional[str] = None) -> bool:
+        record = {"time": time.strftime('%Y-%m-%dT%H:%M:%S'), **record}
+        if prompt is not None:
+            record["prompt_hash"] = self.prompt_hash(prompt)
+            if random.random() < self.sample_rate:
+                record["prompt"] = prompt
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _writer(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                line = json.dumps(record, ensure_ascii=False, default=str)
+                self.handler.handle(logging.makeLogRecord({"msg": line}))
+            except Exception as e:
+                print(f"Error writing prompt log: {e}")
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        self.handler.close()
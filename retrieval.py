@@ -0,0 +1,284 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from keywords import tokenize
+
+BM25_FILENAME = "bm25_index.json"
+BM25_LOG_FILENAME = "bm25_index.log.jsonl"  # changes made since bm25_index.json was written
+RRF_K = 60
+DATE_PATTERN = re.compile(r"^(\d{4})-?(\d{2})-?(\d{2})$")
+
+
+def parse_date(value) -> Optional[int]:
+    """``YYYY-MM-DD`` / ``YYYYMMDD`` to the integer ``YYYYMMDD`` stored in chunk metadata."""
+    if value is None:
+        return None
+    match = DATE_PATTERN.match(str(value).strip())
+    try:
+        if not match:
+            raise ValueError("expected YYYY-MM-DD")
+        # rejects dates no filing can carry, such as 2024-13-01 or 2024-02-31
+        day = date(*(int(part) for part in match.groups()))
+    except ValueError as e:
+        raise ValueError(f"Invalid date {value!r}: {e}") from None
+    return int(day.strftime("%Y%m%d"))
+
+
+def build_filters(company: Optional[str] = None, file_type: Optional[str] = None,
+                  date_from=None, date_to=None) -> Optional[Dict]:
+    """Normalize optional retrieval filters; None when nothing is filtered."""
+    filters = {
+        "company": company,
+        "file_type": file_type.lower().lstrip(".") if file_type else None,
+        "date_from": parse_date(date_from),
+        "date_to": parse_date(date_to),
+    }
+    filters = {key: value for key, value in filters.items() if value}
+    return filters or None
+
+
+def metadata_matches(metadata: Dict, filters: Optional[Dict]) -> bool:
+    if not filters:
+        return True
+    if "company" in filters and metadata.get("company") != filters["company"]:
+        return False
+    if "file_type" in filters and metadata.get("file_type") != filters["file_type"]:
+        return False
+    date = metadata.get("date") or 0
+    if "date_from" in filters and date < filters["date_from"]:
+        return False
+    if "date_to" in filters and date > filters["date_to"]:
+        return False
+    return True
+
+
+def copy_matches(copies: Optional[Dict[str, List[Dict]]], filters: Optional[Dict]) -> List[str]:
+    """Canonical chunk ids with a deduplicated copy (see dedup.load_copies) that matches the filters."""
+    if not filters or not copies:
+        return []
+    return [chunk_id for chunk_id, variants in copies.items()
+            if any(metadata_matches(variant, filters) for variant in variants)]
+
+
+def vector_where(filters: Optional[Dict], copy_ids: Sequence[str] = ()) -> Optional[Dict]:
+    """Translate filters into a Chroma ``where`` clause (also understood by MmapVectorIndex).
+
+    ``copy_ids`` (see copy_matches) are chunks kept in place of a matching
+    copy; they are matched on the ``chunk_id`` stored in their metadata.
+    """
+    if not filters:
+        return None
+    conditions = []
+    if "company" in filters:
+        conditions.append({"company": {"$eq": filters["company"]}})
+    if "file_type" in filters:
+        conditions.append({"file_type": {"$eq": filters["file_type"]}})
+    if "date_from" in filters:
+        conditions.append({"date": {"$gte": filters["date_from"]}})
+    if "date_to" in filters:
+        conditions.append({"date": {"$lte": filters["date_to"]}})
+    where = conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    if copy_ids:
+        where = {"$or": [where, {"chunk_id": {"$in": list(copy_ids)}}]}
+    return where
+
+
+class BM25Index:
+    """Sparse inverted index over the same chunks stored in the vector DB.
+
+    Exact identifiers (endpoint paths, parameter names, disclosure codes)
+    are matched term-for-term here where dense embeddings tend to blur them.
+    Postings are partitioned by the chunk's company, so a company-scoped
+    search only walks that company's postings; IDF stays corpus-wide.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}      # chunk id -> {"text", "metadata", "length"}
+        self.postings = {}  # company -> term -> {chunk id: term frequency}
+        self.df = Counter()  # term -> number of chunks containing it
+        self.total_length = 0
+        self._journal = []       # changes not yet written to the log file
+        self._logged = 0         # changes in the log file on disk
+        self._full_save = True   # the snapshot on disk (if any) is not this index's base
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, chunk_id: str, text: str, metadata: Optional[Dict] = None):
+        if chunk_id in self.docs:
+            self.remove(chunk_id)
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self.docs[chunk_id] = {"text": text, "metadata": metadata or {}, "length": length}
+        self.total_length += length
+        partition = self.postings.setdefault((metadata or {}).get("company", ""), {})
+        for term, tf in terms.items():
+            partition.setdefault(term, {})[chunk_id] = tf
+            self.df[term] += 1
+        self._journal.append({"op": "add", "id": chunk_id, "text": text, "metadata": metadata or {}})
+
+    def add_documents(self, ids: Sequence[str], documents: Iterable[Document]):
+        for chunk_id, doc in zip(ids, documents):
+            self.add(chunk_id, doc.page_content, doc.metadata)
+
+    def remove(self, chunk_id: str):
+        doc = self.docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        self._journal.append({"op": "remove", "id": chunk_id})
+        self.total_length -= doc["length"]
+        company = doc["metadata"].get("company", "")
+        partition = self.postings.get(company, {})
+        for term in set(tokenize(doc["text"])):
+            posting = partition.get(term)
+            if posting is not None and posting.pop(chunk_id, None) is not None:
+                self.df[term] -= 1
+                if not self.df[term]:
+                    del self.df[term]
+                if not posting:
+                    del partition[term]
+        if not partition:
+            self.postings.pop(company, None)
+
+    def search(self, query: str, k: int = 3, filters: Optional[Dict] = None,
+               copy_ids: Sequence[str] = ()) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, score); ``copy_ids`` match the filters whatever their own metadata."""
+        if not self.docs:
+            return []
+        num_docs = len(self.docs)
+        avgdl = self.total_length / num_docs or 1.0
+        if filters and "company" in filters:
+            partitions = [self.postings.get(filters["company"], {})]
+        else:
+            partitions = list(self.postings.values())
+        copy_ids = set(copy_ids)
+        scores = Counter()
+        for term in set(tokenize(query)):
+            df = self.df.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            for partition in partitions:
+                for chunk_id, tf in partition.get(term, {}).items():
+                    if (filters and chunk_id not in copy_ids
+                            and not metadata_matches(self.docs[chunk_id]["metadata"], filters)):
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.docs[chunk_id]["length"] / avgdl)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(k)
+
+    def get_document(self, chunk_id: str) -> Document:
+        doc = self.docs[chunk_id]
+        return Document(page_content=doc["text"], metadata=doc["metadata"])
+
+    def vocabulary(self) -> Dict:
+        """The keywords vocabulary (same shape as keywords.build_vocabulary) without re-tokenizing."""
+        return {"num_docs": len(self.docs), "df": dict(self.df)}
+
+    def save(self, db_dir: str):
+        """Append the changes since the last save to the log; rewrite the snapshot once the log is large.
+
+        Replaying the log is idempotent, so a crash between writing a new
+        snapshot and truncating the log still loads the same index.
+        """
+        path = os.path.join(db_dir, BM25_FILENAME)
+        log_path = os.path.join(db_dir, BM25_LOG_FILENAME)
+        if self._full_save or self._logged + len(self._journal) > max(1000, len(self.docs) // 2):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "docs": self.docs}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            open(log_path, "w").close()
+            self._logged, self._full_save = 0, False
+        elif self._journal:
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(change, ensure_ascii=False) + "\n" for change in self._journal)
+            self._logged += len(self._journal)
+        self._journal = []
+
+    @classmethod
+    def load(cls, db_dir: str) -> Optional["BM25Index"]:
+        path = os.path.join(db_dir, BM25_FILENAME)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading BM25 index {path}: {e}")
+            return None
+        index = cls(k1=data["k1"], b=data["b"])
+        for chunk_id, doc in data["docs"].items():
+            index.add(chunk_id, doc["text"], doc["metadata"])
+        truncated = False
+        try:
+            with open(os.path.join(db_dir, BM25_LOG_FILENAME), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        truncated = True  # a line cut short by a crash mid-append
+                        break
+                    if change["op"] == "add":
+                        index.add(change["id"], change["text"], change["metadata"])
+                    else:
+                        index.remove(change["id"])
+                    index._logged += 1
+        except FileNotFoundError:
+            pass
+        index._journal = []
+        # appending after a torn line would hide the new changes: rewrite instead
+        index._full_save = truncated
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[str]:
+    scores = Counter()
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    return [key for key, _ in scores.most_common()]
+
+
+def hybrid_search(db, bm25: Optional[BM25Index], query: str, k: int = 3, candidates: Optional[int] = None,
+                  filters: Optional[Dict] = None, copies: Optional[Dict[str, List[Dict]]] = None) -> List[Document]:
+    """Fuse dense and BM25 results with reciprocal rank fusion.
+
+    Chunks are matched across the two indexes by their text, since the
+    vector store does not hand back its ids from similarity_search.
+    ``filters`` (see build_filters) are applied inside both searches, so
+    only matching chunks are ever ranked. A chunk also matches when one of
+    the copies deduplicated into it does (``copies``, see dedup.load_copies).
+    """
+    candidates = candidates or k * 3
+    copy_ids = copy_matches(copies, filters)
+    if filters:
+        dense_docs = db.similarity_search(query, k=candidates, filter=vector_where(filters, copy_ids))
+    else:
+        dense_docs = db.similarity_search(query, k=candidates)
+    if not bm25:
+        return dense_docs[:k]
+
+    by_text = {}
+    dense_ranking = []
+    for doc in dense_docs:
+        by_text.setdefault(doc.page_content, doc)
+        dense_ranking.append(doc.page_content)
+
+    sparse_ranking = []
+    for chunk_id, _ in bm25.search(query, k=candidates, filters=filters, copy_ids=copy_ids):
+        doc = bm25.get_document(chunk_id)
+        by_text.setdefault(doc.page_content, doc)
+        sparse_ranking.append(doc.page_content)
+
+    fused = reciprocal_rank_fusion([dense_ranking, sparse_ranking])
+    return [by_text[text] for text in fused[:k]]
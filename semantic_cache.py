@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticCache:
+    """Nearest-neighbour answer cache keyed by question embeddings.
+
+    Entries are kept in LRU order; anything older than ``ttl`` seconds is
+    dropped on lookup and the least recently used entry goes once
+    ``max_size`` is reached. All methods take a lock: cross-worker syncs
+    add and clear entries from the answer store's writer thread.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_size: int = 1000, ttl: float = 0):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # question -> (unit vector, answer, created_at)
+        self._keys = []
+        self._matrix = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, question: str) -> bool:
+        with self.lock:
+            return question in self.entries
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _invalidate(self):
+        self._matrix = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def purge_expired(self) -> List[str]:
+        if not self.ttl:
+            return []
+        now = time.time()
+        with self.lock:
+            expired = [q for q, (_, _, created) in self.entries.items() if self._expired(created, now)]
+            for question in expired:
+                del self.entries[question]
+            if expired:
+                self._invalidate()
+        return expired
+
+    def lookup(self, vector) -> Optional[Tuple[str, str, float]]:
+        """Return ``(question, answer, similarity)`` of the best match above threshold."""
+        query = self._normalize(vector)
+        with self.lock:
+            if not self.entries:
+                return None
+            if self._matrix is None:
+                self._keys = list(self.entries.keys())
+                self._matrix = np.stack([self.entries[q][0] for q in self._keys])
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score < self.threshold:
+                return None
+            question = self._keys[best]
+            _, answer, created_at = self.entries[question]
+            if self._expired(created_at, time.time()):
+                return None
+            self.entries.move_to_end(question)
+            return question, answer, score
+
+    def add(self, question: str, vector, answer: str, created_at: Optional[float] = None) -> List[str]:
+        """Insert an entry and return the questions evicted to make room for it."""
+        vec = self._normalize(vector)
+        with self.lock:
+            self.entries[question] = (vec, answer, created_at or time.time())
+            self.entries.move_to_end(question)
+            evicted = []
+            while len(self.entries) > self.max_size:
+                old_question, _ = self.entries.popitem(last=False)
+                evicted.append(old_question)
+            self._invalidate()
+        return evicted
+
+    def remove(self, question: str):
+        with self.lock:
+            if self.entries.pop(question, None) is not None:
+                self._invalidate()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self._invalidate()
@@ -0,0 +1,131 @@
+"""Offline comparison of the Chroma store and the memory-mapped vector index.
+
+A synthetic clustered corpus is written to a persistent Chroma directory and
+exported with ``MmapVectorIndex.from_chroma`` exactly like process.py does.
+Each backend is then opened in a fresh process, so load time and memory are
+not flattered by the other one, and queried by vector. Reported per backend:
+load time, RSS after the queries (split into anonymous memory and file-backed
+pages, which several workers share), queries per second and recall@k against
+an exact float32 scan:
+
+    python vector_benchmark.py --corpus-size 50000 --dtype int8 --nlist 256
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+
+from vector_index import MMAP_DIRNAME, MmapVectorIndex, open_mmap_index
+
+CHROMA_BATCH = 5000
+
+
+def make_corpus(size: int, dim: int, clusters: int, seed: int = 0):
+    rng = np.random.RandomState(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.randint(clusters, size=size)] + 0.5 * rng.normal(size=(size, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = centers[rng.randint(clusters, size=size // 100 + 1)] + 0.5 * rng.normal(size=(size // 100 + 1, dim))
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def memory_mb() -> Dict:
+    """Current RSS split by kind where /proc is available, peak RSS otherwise."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        kb = {key: int(fields[key].split()[0]) for key in ("VmRSS", "RssAnon", "RssFile") if key in fields}
+        return {"rss_mb": round(kb["VmRSS"] / 1024, 1),
+                "rss_anon_mb": round(kb.get("RssAnon", 0) / 1024, 1),
+                "rss_file_mb": round(kb.get("RssFile", 0) / 1024, 1)}
+    except (OSError, KeyError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss_mb": round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)}
+
+
+def run_backend(backend: str, db_dir: str, queries: np.ndarray, k: int, nprobe: int, result):
+    start = time.perf_counter()
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+        store = Chroma(persist_directory=db_dir)
+    else:
+        store = open_mmap_index(db_dir, None, nprobe=nprobe)
+    store.similarity_search_by_vector(queries[0].tolist(), k=k)  # first query pays any lazy loading
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retrieved = [[doc.page_content for doc in store.similarity_search_by_vector(query.tolist(), k=k)]
+                 for query in queries]
+    elapsed = time.perf_counter() - start
+    result.put({
+        "load_ms": round(load_seconds * 1000, 1),
+        "qps": round(len(queries) / elapsed, 1) if elapsed else 0.0,
+        **memory_mb(),
+        "retrieved": retrieved,
+    })
+
+
+def measure(backend: str, db_dir: str, queries: np.ndarray, k: int, nprobe: int, truth) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    result = context.Queue()
+    process = context.Process(target=run_backend, args=(backend, db_dir, queries, k, nprobe, result))
+    process.start()
+    stats = result.get()
+    process.join()
+    retrieved = stats.pop("retrieved")
+    stats["recall_at_k"] = round(float(np.mean([len(set(r) & t) / len(t) for r, t in zip(retrieved, truth)])), 4)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma vs memory-mapped vector index")
+    parser.add_argument("--corpus-size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384, help="all-minilm embeddings are 384-d")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--dtype", choices=["float16", "int8"], default="float16")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists, 0 for an exact scan")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--output", default="vector_bench.json")
+    args = parser.parse_args()
+
+    import chromadb
+    from langchain_chroma import Chroma
+
+    vectors, queries = make_corpus(args.corpus_size, args.dim, args.clusters)
+    texts = [f"chunk-{i}" for i in range(len(vectors))]
+    truth = [{texts[i] for i in np.argsort(-(vectors @ (q / np.linalg.norm(q))))[:args.k]} for q in queries]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        # the collection name langchain's Chroma opens by default
+        collection = chromadb.PersistentClient(path=db_dir).get_or_create_collection("langchain")
+        for start in range(0, len(vectors), CHROMA_BATCH):
+            stop = start + CHROMA_BATCH
+            collection.add(ids=texts[start:stop], embeddings=vectors[start:stop].tolist(),
+                           documents=texts[start:stop], metadatas=[{"source": "synthetic"}] * len(texts[start:stop]))
+
+        start = time.perf_counter()
+        MmapVectorIndex.from_chroma(Chroma(persist_directory=db_dir), os.path.join(db_dir, MMAP_DIRNAME),
+                                    dtype=args.dtype, nlist=args.nlist)
+        results["mmap_build_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        for backend in ("chroma", "mmap"):
+            results[backend] = measure(backend, db_dir, queries, args.k, args.nprobe, truth)
+        results["mmap_index_mb"] = round(sum(
+            entry.stat().st_size for entry in os.scandir(os.path.join(db_dir, MMAP_DIRNAME))) / 2 ** 20, 1)
+
+    results["config"] = vars(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
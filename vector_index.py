@@ -0,0 +1,300 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+MMAP_DIRNAME = "mmap_index"
+BLOCK_ROWS = 65536  # rows converted to float32 per matmul
+EXPORT_PAGE_ROWS = 5000  # rows read from Chroma per page by from_chroma
+FILTER_COLUMNS = ("company", "file_type", "date")
+WHERE_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _where_sql(where: Dict) -> Tuple[str, List]:
+    """Translate the Chroma ``where`` subset built by retrieval.vector_where into SQL."""
+    for combinator in ("$and", "$or"):
+        if combinator in where:
+            parts = [_where_sql(condition) for condition in where[combinator]]
+            return (f" {combinator[1:].upper()} ".join(f"({sql})" for sql, _ in parts),
+                    [p for _, params in parts for p in params])
+    (key, condition), = where.items()
+    if key not in FILTER_COLUMNS and key != "chunk_id":
+        raise ValueError(f"Cannot filter on {key!r}, expected one of {FILTER_COLUMNS + ('chunk_id',)}")
+    column = "id" if key == "chunk_id" else key
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    (operator, value), = condition.items()
+    if operator == "$in":
+        return f"{column} IN ({','.join('?' * len(value))})", list(value)
+    return f"{column} {WHERE_OPERATORS[operator]} ?", [value]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample; good enough for a coarse IVF partition."""
+    rng = np.random.RandomState(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class MmapVectorIndex:
+    """Read-only vector store over a memory-mapped, quantized embedding matrix.
+
+    Embeddings are L2-normalized and stored as float16 or int8 (one scale per
+    row) in ``.npy`` files opened with ``mmap_mode="r"``, so several API
+    workers on one host share the same page-cache pages instead of each
+    loading its own copy. Chunk texts and metadata live in a SQLite side
+    table and are only read for the top-k hits. With ``nlist`` > 0 rows are
+    grouped by an IVF coarse partition and a query scans ``nprobe`` lists.
+    Without IVF rows are stored grouped by company, and a filtered search
+    scores only the rows the side table selects, so a company-scoped query
+    reads that company's pages rather than the whole matrix.
+
+    ``similarity_search`` has the same signature and result as the Chroma
+    vector store, so it can be handed to ``hybrid_search`` unchanged.
+    """
+
+    def __init__(self, path: str, embedding_function, nprobe: int = 8):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.nprobe = nprobe
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # an empty array has no pages to map
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if self.meta["count"] else None)
+        self.scales = np.load(os.path.join(path, "scales.npy")) if self.meta["dtype"] == "int8" else None
+        if self.meta["nlist"]:
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        # opened together with the vectors: a rebuild swaps the directory out by
+        # path, and reopening by path later would pair new rows with old vectors
+        uri = f"file:{os.path.join(path, 'docs.sqlite')}?mode=ro"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._conn_lock = threading.Lock()
+
+    def __len__(self):
+        return self.meta["count"]
+
+    @classmethod
+    def build(cls, path: str, ids: Sequence[str], vectors, texts: Sequence[str], metadatas: Sequence[Dict],
+              dtype: str = "float16", nlist: int = 0):
+        """Write a new index to ``path``, replacing any index already there.
+
+        The index is built in a staging directory and swapped in with renames.
+        An open MmapVectorIndex holds its vectors and side table open, so it
+        keeps reading the old files until it is reopened.
+        """
+        cls.build_pages(path, [(ids, vectors, texts, metadatas)], len(ids), dtype=dtype, nlist=nlist)
+
+    @classmethod
+    def build_pages(cls, path: str, pages: Iterable[Tuple[Sequence[str], Any, Sequence[str], Sequence[Dict]]],
+                    count: int, dtype: str = "float16", nlist: int = 0):
+        """``build`` from ``(ids, vectors, texts, metadatas)`` pages holding ``count`` rows in total.
+
+        Pages are normalized into a float32 staging memmap and their texts
+        go straight to SQLite, so memory use stays at one page plus the row
+        order rather than the whole corpus.
+        """
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported dtype {dtype!r}, expected 'float16' or 'int8'")
+        final_path, path = path, path + ".building"
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        conn = sqlite3.connect(os.path.join(path, "docs.sqlite"))
+        conn.execute("CREATE TABLE staged (position INTEGER PRIMARY KEY, id TEXT, text TEXT, metadata TEXT, "
+                     "company TEXT, file_type TEXT, date INTEGER)")
+        raw_path = os.path.join(path, "raw.npy")
+        raw, written = None, 0
+        for ids, vectors, texts, metadatas in pages:
+            if not len(ids):
+                continue
+            vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+            if raw is None:
+                raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float32,
+                                                shape=(count, vectors.shape[1]))
+            # a store that changed while it was read may hand back more rows than counted
+            vectors = vectors[:count - written]
+            raw[written:written + len(vectors)] = vectors
+            conn.executemany(
+                "INSERT INTO staged VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((written + i, ids[i], texts[i], json.dumps(metadatas[i] or {}, ensure_ascii=False),
+                  *((metadatas[i] or {}).get(column) for column in FILTER_COLUMNS))
+                 for i in range(len(vectors))),
+            )
+            written += len(vectors)
+        raw = raw[:written] if raw is not None else np.zeros((0, 0), dtype=np.float32)
+
+        nlist = min(nlist, written)
+        if nlist:
+            centroids = _kmeans(raw, nlist)
+            assign = np.empty(written, dtype=np.int64)
+            for start in range(0, written, BLOCK_ROWS):
+                assign[start:start + BLOCK_ROWS] = np.argmax(raw[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+            np.save(os.path.join(path, "centroids.npy"), centroids)
+            np.save(os.path.join(path, "offsets.npy"), offsets)
+        else:
+            positions = conn.execute("SELECT position FROM staged ORDER BY COALESCE(company, ''), position")
+            order = np.fromiter((position for position, in positions), dtype=np.int64, count=written)
+
+        dim = raw.shape[1]
+        vectors_path = os.path.join(path, "vectors.npy")
+        if written:
+            stored = np.lib.format.open_memmap(vectors_path, mode="w+", shape=(written, dim),
+                                               dtype=np.int8 if dtype == "int8" else np.float16)
+        else:
+            stored = np.zeros((0, dim), dtype=dtype)
+        scales = np.empty(written, dtype=np.float32)
+        for start in range(0, written, BLOCK_ROWS):
+            block = raw[order[start:start + BLOCK_ROWS]]
+            if dtype == "int8":
+                block_scales = np.abs(block).max(axis=1) / 127.0
+                block_scales[block_scales == 0] = 1.0
+                scales[start:start + len(block)] = block_scales
+                stored[start:start + len(block)] = np.round(block / block_scales[:, None])
+            else:
+                stored[start:start + len(block)] = block
+        if written:
+            stored.flush()
+        else:
+            np.save(vectors_path, stored)
+        del stored, raw
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        if dtype == "int8":
+            np.save(os.path.join(path, "scales.npy"), scales)
+
+        conn.execute("CREATE TABLE ordering (position INTEGER PRIMARY KEY, row INTEGER)")
+        conn.executemany("INSERT INTO ordering VALUES (?, ?)",
+                         ((int(position), row) for row, position in enumerate(order)))
+        conn.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, id TEXT, text TEXT, metadata TEXT, "
+                     "company TEXT, file_type TEXT, date INTEGER)")
+        conn.execute("INSERT INTO docs SELECT o.row, s.id, s.text, s.metadata, s.company, s.file_type, s.date "
+                     "FROM staged s JOIN ordering o USING (position)")
+        conn.execute("DROP TABLE staged")
+        conn.execute("DROP TABLE ordering")
+        conn.execute("CREATE INDEX docs_company ON docs (company, file_type, date)")
+        conn.execute("CREATE INDEX docs_id ON docs (id)")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dtype": dtype, "count": written, "dim": int(dim), "nlist": int(nlist)}, f)
+
+        old_path = final_path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(final_path):
+            os.rename(final_path, old_path)
+        os.rename(path, final_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def from_chroma(cls, db, path: str, dtype: str = "float16", nlist: int = 0, page_size: int = EXPORT_PAGE_ROWS):
+        """Export every embedding, text and metadata from a Chroma store, ``page_size`` rows at a time."""
+        count = len(db.get(include=[])["ids"])
+
+        def pages():
+            for offset in range(0, count, page_size):
+                data = db.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+                yield data["ids"], data["embeddings"], data["documents"], data["metadatas"]
+
+        cls.build_pages(path, pages(), count, dtype=dtype, nlist=nlist)
+
+    def _query(self, sql: str, params: Sequence = ()) -> List[Tuple]:
+        with self._conn_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _score(self, start: int, stop: int, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(stop - start, dtype=np.float32)
+        for block in range(start, stop, BLOCK_ROWS):
+            end = min(block + BLOCK_ROWS, stop)
+            part = self.vectors[block:end].astype(np.float32) @ query
+            if self.scales is not None:
+                part *= self.scales[block:end]
+            scores[block - start:end - start] = part
+        return scores
+
+    def _score_rows(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scores = self.vectors[rows].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return scores
+
+    def _filtered_rows(self, where: Dict) -> np.ndarray:
+        sql, params = _where_sql(where)
+        rows = self._query(f"SELECT row FROM docs WHERE {sql} ORDER BY row", params)
+        return np.fromiter((row for row, in rows), dtype=np.int64, count=len(rows))
+
+    def search_rows(self, embedding: Sequence[float], k: int = 4, filter: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity) pairs for a query embedding.
+
+        ``filter`` is a Chroma-style ``where`` clause; filtered searches are
+        an exact scan over the matching rows and skip the IVF lists.
+        """
+        if not len(self):
+            return []
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        if filter:
+            rows = self._filtered_rows(filter)
+            scores = self._score_rows(rows, query)
+        else:
+            if self.meta["nlist"]:
+                lists = np.argsort(-(self.centroids @ query))[:self.nprobe]
+                ranges = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in lists]
+            else:
+                ranges = [(0, len(self))]
+            rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+            scores = np.concatenate([self._score(start, stop, query) for start, stop in ranges])
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def _documents(self, rows: List[int]) -> List[Document]:
+        found = {}
+        for row, text, metadata in self._query(
+                f"SELECT row, text, metadata FROM docs WHERE row IN ({','.join('?' * len(rows))})", rows):
+            found[row] = Document(page_content=text, metadata=json.loads(metadata))
+        return [found[row] for row in rows]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        hits = self.search_rows(self.embedding_function.embed_query(query), k, filter)
+        docs = self._documents([row for row, _ in hits])
+        return [(doc, score) for doc, (_, score) in zip(docs, hits)]
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4,
+                                    filter: Optional[Dict] = None) -> List[Document]:
+        return self._documents([row for row, _ in self.search_rows(embedding, k, filter)])
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+
+def open_mmap_index(db_dir: str, embedding_function, nprobe: int = 8) -> Optional[MmapVectorIndex]:
+    path = os.path.join(db_dir, MMAP_DIRNAME)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return MmapVectorIndex(path, embedding_function, nprobe=nprobe)